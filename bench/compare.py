@@ -0,0 +1,79 @@
+import argparse
+import json
+import sys
+
+# Compares two bench/run.py result files metric by metric and exits with status 1 on a regression,
+# so it can gate a commit in CI: python compare.py baseline.json results.json
+
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "mean_ms", "seconds", "build_seconds", "load_seconds", "index_mb", "max_rss_mb")
+HIGHER_IS_BETTER = ("qps", "chunks_per_second")
+QUALITY = ("recall_at_",)
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+def direction(path: str):
+    # 1 when higher is better, -1 when lower is better, None for counts and settings
+    name = path.rsplit(".", 1)[-1]
+    if name.startswith(QUALITY) or name in HIGHER_IS_BETTER:
+        return 1
+    if name in LOWER_IS_BETTER or ".relations_mb." in path:
+        return -1
+    return None
+
+def compare(base: dict, new: dict, threshold: float, recall_threshold: float, min_delta_ms: float):
+    rows, regressions = [], []
+    base_flat, new_flat = flatten(base), flatten(new)
+    for path in sorted(set(base_flat) & set(new_flat)):
+        if path.startswith("meta."):
+            continue
+        sign = direction(path)
+        if sign is None:
+            continue
+        old, current = base_flat[path], new_flat[path]
+        change = (current - old) / old if old else 0.0
+        if path.rsplit(".", 1)[-1].startswith(QUALITY):
+            # Recall is already a fraction, so an absolute drop is the meaningful measure
+            worse = old - current > recall_threshold
+        elif path.endswith("_ms") and abs(current - old) < min_delta_ms:
+            # Sub-millisecond swings are noise, whatever they are in percent
+            worse = False
+        else:
+            worse = -sign * change > threshold
+        rows.append((path, old, current, change, worse))
+        if worse:
+            regressions.append(path)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base", help="Baseline results, e.g. from the parent commit")
+    parser.add_argument("new", help="Results to check")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown that counts as a regression (default 10%%)")
+    parser.add_argument("--recall-threshold", type=float, default=0.01, help="Absolute recall drop that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes smaller than this")
+    parser.add_argument("-a", "--all", action="store_true", help="List every metric, not only the regressions")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"base {base.get('meta', {}).get('commit')} vs new {new.get('meta', {}).get('commit')}")
+    rows, regressions = compare(base, new, args.threshold, args.recall_threshold, args.min_delta_ms)
+    width = max((len(row[0]) for row in rows), default=0)
+    for path, old, current, change, worse in rows:
+        if args.all or worse:
+            print(f"{'REGRESSION ' if worse else '           '}{path:<{width}}  {old:12.3f} -> {current:12.3f}  ({change:+.1%})")
+    print(f"{len(rows)} metrics compared, {len(regressions)} regressions")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
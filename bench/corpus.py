@@ -0,0 +1,81 @@
+import os
+import numpy as np
+from fake_ollama import embed_text, word_vector
+
+# Synthetic corpora with a Zipf-distributed made-up vocabulary, reproducible from a seed.
+# Chunks are around 350 characters, the size cli/document_processing/splitter.py produces.
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "po", "ve", "zu", "an", "el", "or", "ix", "um", "qua"]
+VOCAB_SIZE = 5000
+WORDS_PER_CHUNK = 50
+BLOCK_SIZE = 1000
+
+def vocabulary(seed: int = 0, size: int = VOCAB_SIZE):
+    rng = np.random.default_rng(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES, size=rng.integers(2, 5))))
+    return sorted(words)
+
+class Corpus:
+    def __init__(self, seed: int = 0, vocab_size: int = VOCAB_SIZE):
+        self.seed = seed
+        self.words = vocabulary(seed, vocab_size)
+        weights = 1.0 / np.arange(1, vocab_size + 1) ** 1.1
+        self.cdf = np.cumsum(weights / weights.sum())
+        self._table = None
+
+    def block(self, index: int) -> np.ndarray:
+        rng = np.random.default_rng((self.seed, index))
+        ids = np.searchsorted(self.cdf, rng.random((BLOCK_SIZE, WORDS_PER_CHUNK)), side="right")
+        return np.minimum(ids, len(self.words) - 1)
+
+    def chunk_ids(self, count: int, start: int = 0) -> np.ndarray:
+        # Generated in fixed blocks, so chunk i is the same however the corpus is sliced
+        if count <= 0:
+            return np.zeros((0, WORDS_PER_CHUNK), dtype=np.int64)
+        first, last = start // BLOCK_SIZE, (start + count - 1) // BLOCK_SIZE
+        rows = np.concatenate([self.block(index) for index in range(first, last + 1)])
+        offset = start - first * BLOCK_SIZE
+        return rows[offset:offset + count]
+
+    def text(self, ids) -> str:
+        return " ".join(self.words[i] for i in ids)
+
+    def embeddings(self, ids: np.ndarray, dims: int) -> np.ndarray:
+        # Same result as the fake Ollama server embedding self.text(ids)
+        if self._table is None or self._table.shape[1] != dims:
+            self._table = np.stack([word_vector(word, dims) for word in self.words])
+        vectors = self._table[ids].sum(axis=1) if len(ids) else np.zeros((0, dims), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def queries(self, count: int, words: int = 6, corpus_size: int = 1000):
+        # Each query is a few words lifted from a random chunk, so it has a clear nearest neighbour
+        rng = np.random.default_rng((self.seed, 1 << 31))
+        sources = rng.integers(0, max(corpus_size, 1), size=count)
+        queries = []
+        for source in sources:
+            ids = self.chunk_ids(1, int(source))[0]
+            offset = rng.integers(0, WORDS_PER_CHUNK - words)
+            queries.append(self.text(ids[offset:offset + words]))
+        return queries
+
+    def write_markdown(self, directory: str, files: int, chunks_per_file: int) -> int:
+        # One paragraph per chunk, so the splitter cuts roughly where the generator did
+        os.makedirs(directory, exist_ok=True)
+        for f in range(files):
+            ids = self.chunk_ids(chunks_per_file, f * chunks_per_file)
+            with open(os.path.join(directory, f"doc-{f:05d}.md"), "w", encoding="utf-8") as out:
+                out.write(f"# Document {f}\n\n")
+                out.write("\n\n".join(self.text(row) for row in ids))
+                out.write("\n")
+        return files * chunks_per_file
+
+def check_embeddings(dims: int = 32):
+    # The in-process embeddings must match the server's, or search results are meaningless
+    corpus = Corpus()
+    ids = corpus.chunk_ids(3)
+    expected = np.stack([embed_text(corpus.text(row), dims) for row in ids])
+    return np.allclose(corpus.embeddings(ids, dims), expected, atol=1e-5)
@@ -0,0 +1,159 @@
+import argparse
+import json
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# A stand-in for the Ollama HTTP API with deterministic output and configurable latency.
+# Embeddings are hashed bags of words: each word maps to a fixed random vector, so texts that
+# share words are close, and the same function embeds synthetic corpora in-process (see corpus.py).
+
+WORD = re.compile(r"[a-z0-9]+")
+
+@lru_cache(maxsize=100000)
+def word_vector(word: str, dims: int) -> np.ndarray:
+    return np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(dims).astype(np.float32)
+
+def embed_text(text: str, dims: int) -> np.ndarray:
+    vector = np.zeros(dims, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        vector += word_vector(word, dims)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class FakeOllama:
+    def __init__(self, dims: int = 768, embed_latency: float = 0.005, embed_per_text: float = 0.001,
+                 chat_latency: float = 0.05, token_latency: float = 0.01, answer_tokens: int = 64):
+        self.dims = dims
+        self.embed_latency = embed_latency
+        self.embed_per_text = embed_per_text
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def embed(self, texts):
+        time.sleep(self.embed_latency + self.embed_per_text * len(texts))
+        return [embed_text(text, self.dims).tolist() for text in texts]
+
+    def reply(self, messages) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        words = WORD.findall(prompt.lower())
+        if any("search queries" in message["content"] for message in messages if message["role"] == "system"):
+            # Query expansion: overlapping slices of the prompt, as a Python list literal
+            slices = [" ".join(words[i:i + 4]) for i in range(0, max(len(words), 1), 3)][:3] or [prompt]
+            return repr(slices)
+        if any("JSON" in message["content"] for message in messages if message["role"] == "system"):
+            return json.dumps({"relevant": [0]})
+        return " ".join((words or ["answer"])[i % max(len(words), 1)] for i in range(self.answer_tokens))
+
+class Handler(BaseHTTPRequestHandler):
+    fake: FakeOllama = None
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        self.fake.count(self.path)
+        if self.path == "/api/tags":
+            self.send_json({"models": []})
+        else:
+            self.send_json({"status": "Ollama is running"})
+
+    def do_POST(self):
+        fake = self.fake
+        fake.count(self.path)
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "")
+        if self.path == "/api/embeddings":
+            self.send_json({"embedding": fake.embed([request.get("prompt", "")])[0]})
+        elif self.path == "/api/embed":
+            texts = request.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self.send_json({"model": model, "embeddings": fake.embed(texts)})
+        elif self.path == "/api/generate":
+            time.sleep(fake.chat_latency)
+            self.send_json({"model": model, "response": "", "done": True})
+        elif self.path == "/api/chat":
+            self.chat(model, request)
+        else:
+            self.send_error(404)
+
+    def chat(self, model: str, request: dict):
+        fake = self.fake
+        time.sleep(fake.chat_latency)
+        content = fake.reply(request.get("messages") or [])
+        if not request.get("stream", True):
+            self.send_json({"model": model, "message": {"role": "assistant", "content": content}, "done": True})
+            return
+        # Newline-delimited JSON, one token per line, then Ollama's closing chunk with eval stats
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        start = time.perf_counter()
+        tokens = content.split(" ")
+        for i, token in enumerate(tokens):
+            time.sleep(fake.token_latency)
+            piece = token if i == 0 else " " + token
+            self.write_chunk({"model": model, "message": {"role": "assistant", "content": piece}, "done": False})
+        self.write_chunk({
+            "model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+            "eval_count": len(tokens), "eval_duration": int((time.perf_counter() - start) * 1e9)
+        })
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, body: dict):
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(fake: FakeOllama, port: int = 0) -> ThreadingHTTPServer:
+    # port 0 picks a free port; read it back from server.server_address
+    handler = type("FakeOllamaHandler", (Handler,), {"fake": fake})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the fake Ollama server on its own, e.g. for the GUI")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dims", type=int, default=768)
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--chat-latency-ms", type=float, default=50)
+    parser.add_argument("--token-latency-ms", type=float, default=10)
+    args = parser.parse_args()
+    server = start_server(FakeOllama(
+        dims=args.dims, embed_latency=args.embed_latency_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000, token_latency=args.token_latency_ms / 1000
+    ), args.port)
+    print(f"Fake Ollama listening on http://127.0.0.1:{args.port} (set OLLAMA_HOST to use it)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
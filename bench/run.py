@@ -0,0 +1,398 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Benchmarks the CLI against a fake Ollama server and a throwaway pgvector database.
+# The cli modules read their settings at import time, so the server, OLLAMA_HOST, the database
+# name and the embedding size are all set up before the first cli import (see prepare()).
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CLI_DIR = os.path.join(os.path.dirname(BENCH_DIR), "cli")
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import Corpus, BLOCK_SIZE
+from fake_ollama import FakeOllama, embed_text, start_server
+
+K = 10
+
+def percentile(values, q: float) -> float:
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+def latency_summary(seconds) -> dict:
+    seconds = np.asarray(seconds, dtype=float)
+    return {
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+        "mean_ms": float(seconds.mean()) * 1000 if len(seconds) else 0.0,
+        "qps": len(seconds) / float(seconds.sum()) if seconds.sum() else 0.0,
+    }
+
+def max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@contextlib.contextmanager
+def patched(module, **values):
+    # The cli modules import their settings by name, so sweeps patch the importing module
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    # The ingestion and recall paths print progress per file and per question
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def prepare(args):
+    # Starts the fake server and points the cli at it and at the benchmark database; returns the server
+    server = start_server(FakeOllama(
+        dims=args.dims, embed_latency=args.embed_latency_ms / 1000, embed_per_text=args.embed_per_text_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000, token_latency=args.token_latency_ms / 1000
+    ))
+    host, port = server.server_address[:2]
+    os.environ["OLLAMA_HOST"] = f"http://{host}:{port}"
+    sys.path.insert(0, CLI_DIR)
+    import config
+    config.STORAGE_BACKEND = "postgres"
+    config.EMBEDDING_SIZE = args.dims
+    config.WARMUP_ON_START = False
+    config.ANSWER_CACHE_ENABLED = False
+    if args.host:
+        config.DB_PARAMS["host"] = args.host
+    if args.port:
+        config.DB_PARAMS["port"] = str(args.port)
+    return server
+
+def create_database(name: str):
+    import psycopg2
+    from config import DB_PARAMS
+    conn = psycopg2.connect(**{**DB_PARAMS, "dbname": "postgres"})
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+            cur.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        conn.close()
+
+def drop_database(name: str):
+    import psycopg2
+    from config import DB_PARAMS
+    from database.connection import close_pool
+    close_pool()
+    conn = psycopg2.connect(**{**DB_PARAMS, "dbname": "postgres"})
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    finally:
+        conn.close()
+
+def run_sql(statement: str, params=None, fetch: bool = False):
+    from database.connection import connect_db, release_db
+    conn = connect_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(statement, params)
+            rows = cur.fetchall() if fetch else None
+        conn.commit()
+        return rows
+    finally:
+        release_db(conn)
+
+def reset_tables():
+    from retrieval.cache import bump_corpus_version, query_embeddings
+    run_sql("TRUNCATE documents, sources, feedback, embedding_cache, answer_cache RESTART IDENTITY CASCADE")
+    query_embeddings.clear()
+    bump_corpus_version()
+
+def relation_sizes() -> dict:
+    rows = run_sql("""
+        SELECT relname, pg_total_relation_size(c.oid)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'i') AND c.relname LIKE 'documents%'
+    """, fetch=True)
+    return {name: size / (1024 * 1024) for name, size in rows}
+
+def bench_ingest(args, corpus: Corpus) -> dict:
+    # Writes the corpus as markdown and times process_directory from a cold catalog and embedding cache
+    from document_processing.pipeline import process_directory
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-ingest-") as directory:
+        files = max(1, args.ingest_chunks // args.chunks_per_file)
+        corpus.write_markdown(directory, files, args.chunks_per_file)
+        for workers in args.workers:
+            reset_tables()
+            start = time.perf_counter()
+            with quiet(not args.verbose):
+                process_directory(directory, workers=workers)
+            elapsed = time.perf_counter() - start
+            chunks = run_sql("SELECT COUNT(*) FROM documents", fetch=True)[0][0]
+            results[f"workers={workers}"] = {
+                "files": files, "chunks": chunks, "seconds": elapsed,
+                "chunks_per_second": chunks / elapsed if elapsed else 0.0,
+            }
+            print(f"ingest workers={workers}: {chunks} chunks in {elapsed:.1f}s ({chunks / elapsed:.0f} chunks/s)")
+    return results
+
+def load_corpus(corpus: Corpus, rows: int, dims: int, query_vectors: np.ndarray):
+    # Bulk loads rows with COPY (ids are 1-based corpus positions) and returns the exact top-K ids per query
+    from database.connection import connect_db, release_db
+    reset_tables()
+    run_sql("DROP INDEX IF EXISTS documents_embedding_idx")
+    best_scores = np.full((len(query_vectors), K), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(query_vectors), K), dtype=np.int64)
+    conn = connect_db()
+    try:
+        for start in range(0, rows, BLOCK_SIZE):
+            ids = corpus.chunk_ids(min(BLOCK_SIZE, rows - start), start)
+            vectors = corpus.embeddings(ids, dims).astype(np.float32)
+            buffer = io.StringIO()
+            for i, (row, vector) in enumerate(zip(ids, vectors.astype(str))):
+                source = f"/bench/doc-{(start + i) // 100:05d}.md"
+                metadata = json.dumps({"source": source, "type": "md"})
+                buffer.write(f"{start + i + 1}\t{corpus.text(row)}\t{metadata}\t[{','.join(vector)}]\n")
+            buffer.seek(0)
+            with conn.cursor() as cur:
+                cur.copy_expert("COPY documents (id, content, metadata, embedding) FROM STDIN", buffer)
+            conn.commit()
+            # Running exact top-K over the blocks, so the whole matrix is never held in memory
+            scores = np.concatenate([best_scores, query_vectors @ vectors.T], axis=1)
+            candidates = np.concatenate([best_ids, np.broadcast_to(np.arange(start + 1, start + len(ids) + 1), (len(query_vectors), len(ids)))], axis=1)
+            top = np.argpartition(-scores, K - 1, axis=1)[:, :K]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_ids = np.take_along_axis(candidates, top, axis=1)
+        with conn.cursor() as cur:
+            cur.execute("SELECT setval('documents_id_seq', %s)", (rows,))
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE documents")
+        conn.autocommit = False
+    finally:
+        release_db(conn)
+    return [set(row) for row in best_ids.tolist()]
+
+def build_index(method: str, rows: int, maintenance_work_mem: str = None) -> float:
+    import database.connection as connection
+    from database.connection import connect_db, release_db, ensure_vector_index
+    lists = max(10, rows // 1000)
+    conn = connect_db()
+    try:
+        with patched(connection, VECTOR_INDEX_TYPE=method, IVFFLAT_LISTS=lists), conn.cursor() as cur:
+            if maintenance_work_mem:
+                cur.execute("SELECT set_config('maintenance_work_mem', %s, true)", (maintenance_work_mem,))
+            start = time.perf_counter()
+            with quiet():
+                ensure_vector_index(cur)
+            conn.commit()
+            return time.perf_counter() - start
+    finally:
+        release_db(conn)
+
+def search_once(conn, query_vector: list, dims: int) -> list:
+    # The SQL retrieval.similarity.vector_search runs, selecting ids so results can be scored
+    from psycopg2 import sql
+    from database.connection import configure_vector_search
+    from retrieval.similarity import nearest_documents, rescore_limit
+    with conn.cursor() as cur:
+        configure_vector_search(cur, rescore_limit(K))
+        cur.execute(
+            sql.SQL("SELECT id FROM ({nearest}) nearest ORDER BY distance").format(
+                nearest=nearest_documents(sql.SQL("TRUE"), dims, sql.Placeholder("limit"))
+            ),
+            {"embedding": query_vector, "limit": K, "rescore": rescore_limit(K)}
+        )
+        ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+def run_queries(query_vectors: list, truth: list, dims: int) -> dict:
+    from database.connection import connect_db, release_db
+    conn = connect_db()
+    try:
+        for vector in query_vectors[:5]:
+            search_once(conn, vector, dims)
+        latencies, recalls = [], []
+        for vector, expected in zip(query_vectors, truth):
+            start = time.perf_counter()
+            ids = search_once(conn, vector, dims)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(expected.intersection(ids)) / K)
+    finally:
+        release_db(conn)
+    return {**latency_summary(latencies), f"recall_at_{K}": float(np.mean(recalls))}
+
+def bench_search(args, corpus: Corpus) -> dict:
+    import database.connection as connection
+    results = {}
+    for rows in args.sizes:
+        queries = corpus.queries(args.queries, corpus_size=rows)
+        query_vectors = np.stack([embed_text(query, args.dims) for query in queries])
+        start = time.perf_counter()
+        truth = load_corpus(corpus, rows, args.dims, query_vectors)
+        size = {"load_seconds": time.perf_counter() - start, "indexes": {}}
+        print(f"search {rows} rows: loaded in {size['load_seconds']:.1f}s")
+        query_lists = query_vectors.tolist()
+
+        # Without the ANN index every query is an exact scan: the baseline the indexes trade recall against
+        run_sql("DROP INDEX IF EXISTS documents_embedding_idx")
+        size["exact"] = run_queries(query_lists, truth, args.dims)
+        for method, setting, values in (("hnsw", "HNSW_EF_SEARCH", args.ef_search), ("ivfflat", "IVFFLAT_PROBES", args.probes)):
+            build_seconds = build_index(method, rows, args.maintenance_work_mem)
+            index = {"build_seconds": build_seconds, "index_mb": relation_sizes().get("documents_embedding_idx", 0.0)}
+            for value in values:
+                with patched(connection, VECTOR_INDEX_TYPE=method, **{setting: value}):
+                    stats = run_queries(query_lists, truth, args.dims)
+                index[f"{setting.split('_', 1)[1].lower()}={value}"] = stats
+                print(
+                    f"  {method} {setting.split('_', 1)[1].lower()}={value}: p50 {stats['p50_ms']:.2f}ms "
+                    f"p99 {stats['p99_ms']:.2f}ms recall@{K} {stats[f'recall_at_{K}']:.3f}"
+                )
+            size["indexes"][method] = index
+        size["relations_mb"] = relation_sizes()
+        size["max_rss_mb"] = max_rss_mb()
+        results[str(rows)] = size
+    return results
+
+def bench_recall(args, corpus: Corpus) -> dict:
+    # Full question path: query expansion, embedding, hybrid search, reranking, then the first streamed token
+    from chat.ollama_chat import recall, generate_response
+    from utils.tracing import question_trace
+    rows = args.recall_rows
+    questions = corpus.queries(args.questions + 1, corpus_size=rows)
+    load_corpus(corpus, rows, args.dims, np.zeros((1, args.dims), dtype=np.float32))
+    build_index("hnsw", rows, args.maintenance_work_mem)
+    recall_seconds, first_token, totals, stages = [], [], [], {}
+    for i, question in enumerate(questions):
+        stats = {}
+        with quiet(not args.verbose), question_trace(question) as trace:
+            start = time.perf_counter()
+            context = recall(question)
+            recalled = time.perf_counter() - start
+            for _ in generate_response(question, context, use_cache=False, stats=stats):
+                pass
+        if i == 0:
+            # Loads the reranker and opens connections; not representative
+            continue
+        recall_seconds.append(recalled)
+        first_token.append(recalled + stats.get("first_token", 0.0))
+        totals.append(time.perf_counter() - start)
+        for span in trace.to_dict()["spans"]:
+            stages.setdefault(span["stage"], []).append(span["duration"])
+    result = {
+        "rows": rows, "questions": len(recall_seconds),
+        "recall": latency_summary(recall_seconds),
+        "time_to_first_token": latency_summary(first_token),
+        "total": latency_summary(totals),
+        "stages": {stage: latency_summary(seconds) for stage, seconds in sorted(stages.items())},
+        "max_rss_mb": max_rss_mb(),
+    }
+    print(
+        f"recall ({rows} rows): p50 {result['recall']['p50_ms']:.0f}ms p99 {result['recall']['p99_ms']:.0f}ms, "
+        f"first token p50 {result['time_to_first_token']['p50_ms']:.0f}ms"
+    )
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, search and recall against a fake Ollama and a throwaway database")
+    parser.add_argument("--suite", nargs="+", choices=["ingest", "search", "recall"], default=["ingest", "search", "recall"])
+    parser.add_argument("-o", "--output", help="Results file (default: results-<commit>-<time>.json in bench/)")
+    parser.add_argument("--database", help="Use this existing database instead of creating and dropping bench_<pid>; its tables are truncated")
+    parser.add_argument("--host", help="Postgres host (default: cli/config.py)")
+    parser.add_argument("--port", type=int, help="Postgres port (default: cli/config.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dims", type=int, default=768, help="Embedding size of the fake model")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Corpus sizes for the search suite, e.g. 10000 100000 1000000")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per search configuration")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--maintenance-work-mem", help="maintenance_work_mem for index builds, e.g. 1GB (default: server setting)")
+    parser.add_argument("--ingest-chunks", type=int, default=10000)
+    parser.add_argument("--chunks-per-file", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--recall-rows", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--embed-latency-ms", type=float, default=5, help="Fake Ollama latency per embedding request")
+    parser.add_argument("--embed-per-text-ms", type=float, default=1, help="Fake Ollama latency per embedded text")
+    parser.add_argument("--chat-latency-ms", type=float, default=50, help="Fake Ollama latency before the first chat token")
+    parser.add_argument("--token-latency-ms", type=float, default=10, help="Fake Ollama latency per chat token")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the cli's own output")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server = prepare(args)
+    from config import DB_PARAMS
+    database = args.database or f"bench_{os.getpid()}"
+    if not args.database:
+        create_database(database)
+    # Mutated in place: database.connection holds a reference to this dict
+    DB_PARAMS["dbname"] = database
+    from database.connection import initialize_db
+
+    results = {
+        "meta": {
+            "commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "seed": args.seed, "dims": args.dims,
+            "fake_ollama": {
+                "embed_latency_ms": args.embed_latency_ms, "embed_per_text_ms": args.embed_per_text_ms,
+                "chat_latency_ms": args.chat_latency_ms, "token_latency_ms": args.token_latency_ms,
+            },
+            "maintenance_work_mem": args.maintenance_work_mem,
+        }
+    }
+    try:
+        with quiet(not args.verbose):
+            initialize_db()
+        results["meta"]["pgvector"] = run_sql("SELECT extversion FROM pg_extension WHERE extname = 'vector'", fetch=True)[0][0]
+        corpus = Corpus(args.seed)
+        if "ingest" in args.suite:
+            results["ingest"] = bench_ingest(args, corpus)
+        if "search" in args.suite:
+            results["search"] = bench_search(args, corpus)
+        if "recall" in args.suite:
+            results["recall"] = bench_recall(args, corpus)
+        results["meta"]["max_rss_mb"] = max_rss_mb()
+        results["meta"]["fake_ollama_requests"] = dict(server.RequestHandlerClass.fake.requests)
+    finally:
+        server.shutdown()
+        if not args.database:
+            drop_database(database)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, f"results-{(results['meta']['commit'] or 'unknown')[:8]}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import hashlib
+from typing import List, Optional
+import psycopg2
+from config import CHAT_MODEL, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_HOURS, ANSWER_CACHE_MAX_ENTRIES
+from database.connection import connect_db, release_db
+from database.migrations import get_embedding_state
+from embedding.embed import get_embedding
+from retrieval.cache import query_embeddings
+
+def context_fingerprint(context: List[dict]) -> str:
+    # Answers are only reused when recall handed the model exactly the same context
+    digest = hashlib.sha256()
+    for message in context:
+        digest.update(message["content"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def embed_prompt(cur, prompt: str):
+    model, _, _, _ = get_embedding_state(cur)
+    embedding = query_embeddings.get((model, prompt))
+    if embedding is None:
+        embedding = get_embedding(prompt, model=model)
+        if embedding:
+            query_embeddings.put((model, prompt), embedding)
+    return model, embedding
+
+def lookup_answer(prompt: str, context: List[dict]) -> Optional[str]:
+    conn = connect_db()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            model, embedding = embed_prompt(cur, prompt)
+            if not embedding:
+                return None
+            cur.execute(
+                """
+                    SELECT id, answer, 1 - (prompt_embedding <=> %(embedding)s::vector) AS similarity
+                    FROM answer_cache
+                    WHERE context_fingerprint = %(fingerprint)s
+                      AND chat_model = %(chat_model)s
+                      AND embedding_model = %(embedding_model)s
+                      AND created_at > CURRENT_TIMESTAMP - make_interval(hours => %(ttl)s)
+                    ORDER BY prompt_embedding <=> %(embedding)s::vector
+                    LIMIT 1
+                """,
+                {
+                    "embedding": embedding, "fingerprint": context_fingerprint(context),
+                    "chat_model": CHAT_MODEL, "embedding_model": model, "ttl": ANSWER_CACHE_TTL_HOURS
+                }
+            )
+            row = cur.fetchone()
+            if row is None or row[2] < ANSWER_CACHE_THRESHOLD:
+                return None
+            cur.execute("UPDATE answer_cache SET last_used = CURRENT_TIMESTAMP WHERE id = %s", (row[0],))
+        conn.commit()
+        return row[1]
+    except psycopg2.Error as e:
+        print(f"Error reading answer cache: {e}")
+        conn.rollback()
+        return None
+    finally:
+        release_db(conn)
+
+def store_answer(prompt: str, context: List[dict], answer: str):
+    conn = connect_db()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            model, embedding = embed_prompt(cur, prompt)
+            if not embedding:
+                return
+            cur.execute(
+                """
+                    INSERT INTO answer_cache (prompt, prompt_embedding, context_fingerprint, chat_model, embedding_model, answer)
+                    VALUES (%s, %s::vector, %s, %s, %s, %s)
+                """,
+                (prompt, embedding, context_fingerprint(context), CHAT_MODEL, model, answer)
+            )
+            # Expired entries go first, then the least recently used beyond the size bound
+            cur.execute(
+                "DELETE FROM answer_cache WHERE created_at <= CURRENT_TIMESTAMP - make_interval(hours => %s)",
+                (ANSWER_CACHE_TTL_HOURS,)
+            )
+            cur.execute(
+                """
+                    DELETE FROM answer_cache WHERE id IN (
+                        SELECT id FROM answer_cache ORDER BY last_used DESC OFFSET %s
+                    )
+                """,
+                (ANSWER_CACHE_MAX_ENTRIES,)
+            )
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error storing answer in cache: {e}")
+        conn.rollback()
+    finally:
+        release_db(conn)
+
+def clear_answer_cache():
+    conn = connect_db()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM answer_cache")
+        conn.commit()
+        print("Answer cache cleared.")
+    except psycopg2.Error as e:
+        print(f"Error clearing answer cache: {e}")
+        conn.rollback()
+    finally:
+        release_db(conn)
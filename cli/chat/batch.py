@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import BATCH_WORKERS
+from chat.ollama_chat import recall, generate_response
+from retrieval.filters import parse_filters
+from utils.output import colorize_output
+from utils.tracing import question_trace
+
+# Input is JSONL with one {"prompt": ..., "id": ..., "filters": "type:pdf dir:~/notes"} object per
+# line ("id" and "filters" optional). Output is JSONL with one record per input line, written in
+# input order, so the output's last record marks where a resumed run picks up.
+
+def completed_lines(output_path: str) -> int:
+    # Line number of the last complete output record; a torn final record is dropped
+    if not os.path.exists(output_path):
+        return 0
+    last = 0
+    offset = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                last = json.loads(line)["line"]
+            except (ValueError, KeyError):
+                break
+            offset += len(line)
+    if os.path.getsize(output_path) > offset:
+        os.truncate(output_path, offset)
+    return last
+
+def answer_line(line_number: int, text: str, use_cache: bool) -> dict:
+    record = {"line": line_number}
+    try:
+        request = json.loads(text)
+        record["id"] = request.get("id")
+        record["prompt"] = prompt = request["prompt"]
+        _, filters = parse_filters(request.get("filters") or "")
+        stats = {}
+        with question_trace(prompt) as trace:
+            start = time.perf_counter()
+            context = recall(prompt, filters=filters)
+            record["recall_s"] = time.perf_counter() - start
+            record["answer"] = "".join(generate_response(prompt, context, use_cache, stats))
+        record["spans"] = trace.to_dict()["spans"]
+        record["context"] = [message["content"] for message in context]
+        record["cached"] = stats.get("cached", False)
+        record["first_token_s"] = stats.get("first_token")
+        record["answer_s"] = stats.get("total")
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+def run_batch(input_path: str, output_path: str, workers: int = BATCH_WORKERS, resume: bool = False,
+              use_cache: bool = True):
+    skip = completed_lines(output_path) if resume else 0
+    if skip:
+        print(colorize_output(f"Resuming after line {skip} of {input_path}.", "yellow"))
+    workers = max(1, workers)
+    start = time.perf_counter()
+    answered = failed = 0
+    with open(input_path, encoding="utf-8") as source, \
+            open(output_path, "a" if resume else "w", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        def write_next():
+            nonlocal answered, failed
+            record = pending.popleft().result()
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            answered += 1
+            failed += "error" in record
+
+        for line_number, text in enumerate(source, start=1):
+            if line_number <= skip or not text.strip():
+                continue
+            # Bounded window: results are written in order while later prompts are still running
+            if len(pending) >= workers * 2:
+                write_next()
+            pending.append(pool.submit(answer_line, line_number, text, use_cache))
+        while pending:
+            write_next()
+    elapsed = time.perf_counter() - start
+    print(colorize_output(
+        f"Answered {answered} prompts ({failed} failed) in {elapsed:.1f}s using {workers} workers, results in {output_path}.",
+        "yellow"
+    ))
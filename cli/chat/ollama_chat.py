@@ -1,27 +1,51 @@
 import ast
+import asyncio
+import time
 import ollama
-from typing import List, Tuple
-from config import CHAT_MODEL
-from retrieval.similarity import retrieve_similar_documents
+from typing import Iterator, List, Tuple
+from config import (
+    CHAT_MODEL, OLLAMA_KEEP_ALIVE, RERANK_CANDIDATES, SPECULATIVE_RETRIEVAL, SPECULATIVE_CONFIDENCE, ANSWER_CACHE_ENABLED, STORAGE_BACKEND
+)
+from chat.answer_cache import lookup_answer, store_answer
+from retrieval.similarity import retrieve_similar_documents_async, rerank_documents
 from utils.output import colorize_output
+from utils.tracing import traced, annotate, record_span, set_gauge, question_trace
 
-def create_queries(prompt):
+def query_conversation(prompt):
     query_message = "Generate a list of search queries to find relevant context for the following prompt. Return only a Python list of strings."
-    query_convo = [
+    return [
         {"role": "system", "content": query_message},
         {"role": "user", "content": "What's the capital of France?"},
         {"role": "assistant", "content": "['capital of France', 'French cities', 'Paris facts']"},
         {"role": "user", "content": prompt}
     ]
-    
-    response = ollama.chat(model=CHAT_MODEL, messages=query_convo)
+
+def parse_queries(content, prompt):
     print("Generating queries...")
-    print(response['message']['content'])
+    print(content)
     
     try:
-        return ast.literal_eval(response['message']['content'])
+        queries = ast.literal_eval(content)
     except:
         return [prompt]
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return [prompt]
+    return queries
+
+@traced("create_queries")
+def create_queries(prompt):
+    response = ollama.chat(model=CHAT_MODEL, messages=query_conversation(prompt), keep_alive=OLLAMA_KEEP_ALIVE)
+    queries = parse_queries(response['message']['content'], prompt)
+    annotate(queries=len(queries))
+    return queries
+
+@traced("create_queries")
+async def create_queries_async(prompt):
+    # Cancelling the task closes the request, so Ollama stops generating
+    response = await ollama.AsyncClient().chat(model=CHAT_MODEL, messages=query_conversation(prompt), keep_alive=OLLAMA_KEEP_ALIVE)
+    queries = parse_queries(response['message']['content'], prompt)
+    annotate(queries=len(queries))
+    return queries
 '''
 def summarize_documents(documents: List[Tuple[str, float]]) -> str:
     summarize_message = "Summarize the following documents into a concise paragraph, preserving the key information:"
@@ -35,20 +59,49 @@ def summarize_documents(documents: List[Tuple[str, float]]) -> str:
     response = ollama.chat(model=CHAT_MODEL, messages=summarize_convo)
     return response['message']['content']
 '''
-def recall(prompt: str) -> List[dict]:
-    queries = create_queries(prompt)
-    all_docs = []
-    for query in queries:
-        similar_docs = retrieve_similar_documents(query, limit=3)  # Get top 3 for each query
-        all_docs.extend(similar_docs)
+async def speculative_recall(prompt: str, top_k: int = 3, filters=None) -> List[Tuple[str, float]]:
+    # Search on the raw prompt while query expansion is still generating
+    expansion = asyncio.create_task(create_queries_async(prompt))
+    raw_docs = (await retrieve_similar_documents_async([prompt], limit=RERANK_CANDIDATES, filters=filters))[0]
+    scored = await asyncio.to_thread(rerank_documents, prompt, raw_docs, len(raw_docs))
     
-    if not all_docs:
+    if len(scored) >= top_k and all(score >= SPECULATIVE_CONFIDENCE for _, score in scored[:top_k]):
+        expansion.cancel()
+        print(colorize_output("Raw prompt hits are confident, skipping query expansion.", "yellow"))
+        return scored[:top_k]
+    
+    # Merge in the expansion results; chunks already scored against the prompt are not rescored
+    try:
+        queries = [query for query in await expansion if query != prompt]
+    except Exception as e:
+        print(f"Error generating queries, using the raw prompt only: {e}")
+        queries = []
+    results = await retrieve_similar_documents_async(queries, limit=RERANK_CANDIDATES, filters=filters)
+    seen = {content for content, _ in scored}
+    new_docs = [doc for similar_docs in results for doc in similar_docs if doc[0] not in seen]
+    if new_docs:
+        scored += await asyncio.to_thread(rerank_documents, prompt, new_docs, len(new_docs))
+    return sorted(scored, key=lambda x: x[1], reverse=True)[:top_k]
+
+def recall(prompt: str, filters=None) -> List[dict]:
+    return asyncio.run(recall_async(prompt, filters))
+
+@traced("recall")
+async def recall_async(prompt: str, filters=None) -> List[dict]:
+    if SPECULATIVE_RETRIEVAL:
+        reranked_docs = await speculative_recall(prompt, filters=filters)
+    else:
+        queries = await create_queries_async(prompt)
+        # All queries are embedded together and searched concurrently, then merged
+        results = await retrieve_similar_documents_async(queries, limit=RERANK_CANDIDATES, filters=filters)
+        all_docs = [doc for similar_docs in results for doc in similar_docs]
+        # Rerank the union of all queries' candidates against the prompt and get top 3
+        reranked_docs = await asyncio.to_thread(rerank_documents, prompt, all_docs, 3)
+    
+    if not reranked_docs:
         print(colorize_output("No relevant context found. Responding without RAG context.", "yellow"))
         return []  # Return an empty list if no relevant documents are found
     
-    # Rerank all retrieved documents and get top 3
-    reranked_docs = sorted(all_docs, key=lambda x: x[1], reverse=True)[:3]
-    
     # Check if the similarity scores are too low
     if all(score < 0.1 for _, score in reranked_docs):  # You can adjust this threshold
         print(colorize_output("Retrieved context not sufficiently relevant. Responding without RAG context.", "yellow"))
@@ -58,28 +111,79 @@ def recall(prompt: str) -> List[dict]:
     # summary = summarize_documents(reranked_docs)
     
     context = [{"role": "system", "content": f"Relevant context summary:\n{doc[0]}"} for doc in reranked_docs]
+    annotate(contexts=len(context))
     print(f"Added summarized context from top 3 documents.")
     return context
 
-def stream_response(prompt: str, context: List[dict]):
+def replay_answer(answer: str):
+    # Cached answers are still delivered piece by piece, like a live generation
+    for piece in answer.split(" "):
+        yield {'message': {'content': piece + " "}}
+
+def chat_messages(prompt: str, context: List[dict]) -> List[dict]:
     if context:
-        messages = [
+        return [
             {"role": "system", "content": "In the recent past, you were a notorious hacker. Your name is Kyle Reese. You explain how hackers worked in the recent past. Use the provided context to answer questions accurately."},
         ] + context + [
             {"role": "user", "content": prompt}
         ]
-    else:
-        messages = [
-            {"role": "system", "content": "In the recent past, you were a notorious hacker. You are a helpful AI hacker assistant. Your name is Kyle Reese. You explain how hackers worked in the recent past. Answer the question to the best of your ability based on your training."},
-            {"role": "user", "content": prompt}
-        ]
-    
-    print(colorize_output("Assistant: ", "yellow"), end="", flush=True)
-    response = ""
-    for chunk in ollama.chat(model=CHAT_MODEL, messages=messages, stream=True):
+    return [
+        {"role": "system", "content": "In the recent past, you were a notorious hacker. You are a helpful AI hacker assistant. Your name is Kyle Reese. You explain how hackers worked in the recent past. Answer the question to the best of your ability based on your training."},
+        {"role": "user", "content": prompt}
+    ]
+
+# Details of the most recent generate_response: whether it was replayed from cache,
+# seconds to the first token and seconds in total
+response_stats = {}
+
+def generate_response(prompt: str, context: List[dict], use_cache: bool = True, stats: dict = None) -> Iterator[str]:
+    # Yields the answer token by token; callers render as it arrives and join the pieces at the end.
+    # Concurrent callers pass their own stats dict instead of sharing response_stats.
+    stats = response_stats if stats is None else stats
+    # The answer cache is a pgvector table
+    use_cache = use_cache and ANSWER_CACHE_ENABLED and STORAGE_BACKEND == "postgres"
+    start = time.perf_counter()
+    cached = lookup_answer(prompt, context) if use_cache else None
+    stats.clear()
+    stats["cached"] = cached is not None
+    stream = replay_answer(cached) if cached is not None else ollama.chat(
+        model=CHAT_MODEL, messages=chat_messages(prompt, context), stream=True, keep_alive=OLLAMA_KEEP_ALIVE
+    )
+    pieces = []
+    for chunk in stream:
         content = chunk['message']['content']
-        response += content
+        if not pieces:
+            stats["first_token"] = time.perf_counter() - start
+        pieces.append(content)
+        if chunk.get('done'):
+            # Ollama's final chunk reports the generated token count and generation time in ns
+            stats["tokens"] = chunk.get('eval_count')
+            stats["tokens_per_second"] = chunk['eval_count'] / (chunk['eval_duration'] / 1e9) if chunk.get('eval_duration') else None
+        yield content
+    stats["total"] = time.perf_counter() - start
+    # Recorded by hand: a span around a generator would stay open in the caller between tokens
+    record_span("generate", start, {key: value for key, value in stats.items() if value is not None})
+    if stats.get("tokens_per_second"):
+        set_gauge("generation_tokens_per_second", stats["tokens_per_second"])
+    if use_cache and cached is None:
+        store_answer(prompt, context, "".join(pieces))
+
+def stream_response(prompt: str, context: List[dict], use_cache: bool = True):
+    print(colorize_output("Assistant: ", "yellow"), end="", flush=True)
+    pieces = []
+    for content in generate_response(prompt, context, use_cache):
+        pieces.append(content)
         print(colorize_output(content, "green"), end="", flush=True)
     
     print("\n")
-    return response
\ No newline at end of file
+    if response_stats["cached"]:
+        print(colorize_output("(answer replayed from cache, ask with 'nocache <question>' to regenerate)", "yellow"))
+    elif "first_token" in response_stats:
+        print(colorize_output(f"(first token after {response_stats['first_token']:.2f}s, {response_stats['total']:.2f}s total)", "yellow"))
+    return "".join(pieces)
+
+def answer(prompt: str, filters=None, use_cache: bool = True) -> str:
+    # Recall and generation for one question, traced as a unit
+    with question_trace(prompt):
+        context = recall(prompt, filters=filters)
+        return stream_response(prompt, context, use_cache)
@@ -0,0 +1,51 @@
+import importlib
+import threading
+import time
+from config import CHAT_MODEL, OLLAMA_KEEP_ALIVE
+from storage.store import get_store
+from utils.output import colorize_output
+
+# Each stage loads something the first answer would otherwise wait for. They run in parallel
+# threads: the Ollama loads happen server-side, the reranker load is local.
+
+def load_chat_model():
+    import ollama
+    # An empty prompt only loads the model
+    ollama.generate(model=CHAT_MODEL, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+
+def load_embedding_model():
+    from embedding.embed import get_embedding
+    get_embedding(["warm-up"], model=get_store().embedding_model())
+
+def load_reranker():
+    from retrieval.similarity import get_reranker
+    get_reranker().predict([("warm-up", "warm-up")])
+
+def load_chat_modules():
+    importlib.import_module("chat.ollama_chat")
+
+WARMUP_STAGES = (
+    ("chat model", load_chat_model),
+    ("embedding model", load_embedding_model),
+    ("reranker", load_reranker),
+    ("chat modules", load_chat_modules),
+)
+
+def run_stage(stage: str, load, report: bool):
+    start = time.perf_counter()
+    try:
+        load()
+    except Exception as e:
+        print(f"Warm-up of the {stage} failed, it will load on first use: {e}")
+        return
+    if report:
+        print(colorize_output(f"Warm-up: {stage} ready after {time.perf_counter() - start:.2f}s", "yellow"))
+
+def start_warmup(report: bool = False):
+    threads = [
+        threading.Thread(target=run_stage, args=(stage, load, report), name=f"warmup-{stage}", daemon=True)
+        for stage, load in WARMUP_STAGES
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
@@ -6,10 +6,81 @@ DB_PARAMS = {
     "host": "localhost",
     "port": "6024"
 }
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = 10
+DB_POOL_TIMEOUT = 30  # Seconds a caller waits for a free pooled connection before giving up
+
+# Storage backend: "postgres" (pgvector, everything below) or "local" (memory-mapped NumPy matrix, no services)
+STORAGE_BACKEND = "postgres"
+LOCAL_STORE_PATH = "~/.local/share/source-me"
+LOCAL_COMPACT_RATIO = 0.5  # Rewrite the local store once this fraction of its rows are tombstoned
 
 # Embedding configuration
 EMBEDDING_MODEL = "nomic-embed-text"
 EMBEDDING_SIZE = 768  # Adjust based on the model's output
+EMBEDDING_BATCH_SIZE = 64  # Chunks embedded per Ollama request during ingestion
+EMBEDDING_CACHE_ENABLED = True  # Reuse embeddings of unchanged chunks, keyed by model and content hash
+EMBEDDING_CACHE_MAX_ENTRIES = 500000  # Least recently used entries beyond this are evicted
+
+# Ingestion pipeline configuration
+INGEST_WORKERS = 4  # Parser processes and concurrent embedding threads for process_dir
+INGEST_WRITER_BATCH_FILES = 16  # Embedded files written per database transaction
+CHUNK_SIZE = 350  # Characters per chunk; changing it only affects documents ingested afterwards
+CHUNK_OVERLAP = 30  # Characters shared by consecutive chunks
+
+# Vector index configuration ("hnsw" or "ivfflat")
+VECTOR_INDEX_TYPE = "hnsw"
+HNSW_M = 16  # Graph connectivity; higher improves recall at the cost of build time and size
+HNSW_EF_CONSTRUCTION = 64  # Candidate list size while building the graph
+HNSW_EF_SEARCH = 40  # Candidate list size per query; raise for recall, lower for latency
+IVFFLAT_LISTS = 100  # Roughly rows / 1000 up to 1M rows, sqrt(rows) beyond
+IVFFLAT_PROBES = 10  # Lists scanned per query; raise for recall, lower for latency
+# What the index stores: "full" (float32), "halfvec" (float16) or "binary" (1 bit per dimension).
+# Compact modes keep the float32 column and rescore the index's top candidates with it (needs pgvector 0.7+).
+EMBEDDING_STORAGE = "full"
+RESCORE_FACTOR = 4  # Compact modes fetch limit * RESCORE_FACTOR candidates before rescoring
+
+# Reranking configuration
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 32  # Query/chunk pairs scored per forward pass
+RERANK_CANDIDATES = 5  # Search hits per generated query fed to the reranker; hybrid search needs fewer
+
+# Retrieval configuration
+SPECULATIVE_RETRIEVAL = True  # Search on the raw prompt while query expansion runs
+SPECULATIVE_CONFIDENCE = 5.0  # Skip expansion when the top raw-prompt hits all rerank above this score
+HYBRID_SEARCH = True  # Fuse pgvector and Postgres full-text rankings with reciprocal rank fusion
+HYBRID_CANDIDATES = 20  # Hits taken from each ranking before fusion
+RRF_K = 60  # Reciprocal rank fusion constant; larger values flatten the contribution of top ranks
+TEXT_SEARCH_CONFIG = "english"  # Postgres text search configuration for the full-text column
+QUERY_CACHE_SIZE = 1024  # In-process LRU of query text -> embedding
+QUERY_CACHE_PERSIST = True  # Back query embeddings with the embedding_cache table across restarts
+RESULT_CACHE_SIZE = 1024  # In-process LRU of search results, cleared whenever the corpus changes
 
 # Chat model configuration
-CHAT_MODEL = "mistral-nemo"
\ No newline at end of file
+CHAT_MODEL = "mistral-nemo"
+OLLAMA_KEEP_ALIVE = "30m"  # How long Ollama keeps the chat and embedding models loaded after a request
+
+# Batch mode configuration
+BATCH_WORKERS = 2  # Prompts answered concurrently; each holds several pooled connections during recall, and searches beyond DB_POOL_MAX_CONN wait for one
+
+# Tracing configuration (see utils/tracing.py)
+TRACE_PRINT = False  # Print a per-stage time breakdown after each answer
+TRACE_LOG_PATH = None  # Append one JSON trace per question to this file, e.g. "traces.jsonl"
+METRICS_FILE = None  # Rewrite Prometheus text metrics here after each question, e.g. for node_exporter's textfile collector
+METRICS_PORT = None  # Serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+
+# Retrieval evaluation configuration (see retrieval/evaluation.py)
+EVAL_K = 3  # Cutoff for recall@k; answers are generated from the top 3 reranked chunks
+EVAL_CANDIDATE_LIMITS = [5, 10, 20, 50]  # Search hits per query, before reranking
+EVAL_EF_SEARCH = [20, 40, 100, 200]  # hnsw.ef_search values tried when VECTOR_INDEX_TYPE is "hnsw"
+EVAL_PROBES = [1, 5, 10, 40]  # ivfflat.probes values tried when VECTOR_INDEX_TYPE is "ivfflat"
+EVAL_QUALITY_TOLERANCE = 0.02  # Recommend the fastest configuration within this recall@k of the best
+
+# Startup configuration
+WARMUP_ON_START = True  # Load the models and the reranker in the background while the first prompt is typed
+
+# Semantic answer cache configuration
+ANSWER_CACHE_ENABLED = False  # Replay a previous answer for a near-identical prompt with the same context
+ANSWER_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity between prompts
+ANSWER_CACHE_TTL_HOURS = 24
+ANSWER_CACHE_MAX_ENTRIES = 1000
\ No newline at end of file
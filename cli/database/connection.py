@@ -1,30 +1,158 @@
 import psycopg2
 from psycopg2 import sql
-from config import DB_PARAMS, EMBEDDING_SIZE
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from config import (
+    DB_PARAMS, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, DB_POOL_TIMEOUT,
+    EMBEDDING_STORAGE, VECTOR_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, IVFFLAT_LISTS, IVFFLAT_PROBES
+)
+from database.migrations import migrate_db, get_embedding_state
+import re
+import threading
 import time
 
+_pool = None
+_pool_lock = threading.Lock()
+# Notified whenever a connection goes back to the pool
+_released = threading.Condition()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, **DB_PARAMS)
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+
+def is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def wait_for_db(max_retries=5, delay=5):
     retries = 0
     while retries < max_retries:
-        try:
-            conn = psycopg2.connect(**DB_PARAMS)
-            conn.close()
+        conn = connect_db()
+        if conn:
+            release_db(conn)
             print("Successfully connected to the database.")
             return True
-        except psycopg2.OperationalError:
-            retries += 1
-            print(f"Database not ready. Retrying in {delay} seconds... (Attempt {retries}/{max_retries})")
-            time.sleep(delay)
+        retries += 1
+        print(f"Database not ready. Retrying in {delay} seconds... (Attempt {retries}/{max_retries})")
+        time.sleep(delay)
     print("Failed to connect to the database after maximum retries.")
     return False
 
-def connect_db():
+def take_connection(pool, deadline: float):
+    # ThreadedConnectionPool raises PoolError when exhausted instead of waiting, so wait here for a release
+    with _released:
+        while True:
+            try:
+                return pool.getconn()
+            except PoolError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                _released.wait(remaining)
+
+def connect_db(timeout: float = DB_POOL_TIMEOUT):
+    # Borrow a connection from the process-wide pool, replacing it if the server dropped it.
+    # Waits up to timeout seconds when all DB_POOL_MAX_CONN connections are borrowed.
     try:
-        return psycopg2.connect(**DB_PARAMS)
+        pool = get_pool()
+        deadline = time.monotonic() + timeout
+        conn = take_connection(pool, deadline)
+        if not is_healthy(conn):
+            pool.putconn(conn, close=True)
+            conn = take_connection(pool, deadline)
+        return conn
     except psycopg2.Error as e:
         print(f"Unable to connect to the database: {e}")
         return None
 
+def release_db(conn):
+    # Return a borrowed connection to the pool; any open transaction is rolled back
+    try:
+        get_pool().putconn(conn)
+    except psycopg2.Error as e:
+        print(f"Error returning connection to the pool: {e}")
+    with _released:
+        _released.notify()
+
+def vector_index_settings():
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        return "ivfflat", {"lists": int(IVFFLAT_LISTS)}
+    return "hnsw", {"m": int(HNSW_M), "ef_construction": int(HNSW_EF_CONSTRUCTION)}
+
+def index_expression(column: str, dims: int, storage: str = EMBEDDING_STORAGE):
+    # "halfvec" and "binary" index a compact copy of the full-precision column, which is kept for rescoring
+    if storage == "halfvec":
+        return sql.SQL("({}::halfvec({}))").format(sql.Identifier(column), sql.Literal(int(dims))), "halfvec_cosine_ops"
+    if storage == "binary":
+        return sql.SQL("(binary_quantize({})::bit({}))").format(sql.Identifier(column), sql.Literal(int(dims))), "bit_hamming_ops"
+    return sql.Identifier(column), "vector_cosine_ops"
+
+def ensure_vector_index(cur, column: str = "embedding", index_name: str = "documents_embedding_idx", dims: int = None):
+    # Create the ANN index, or rebuild it when the configured type, storage or build parameters changed
+    method, params = vector_index_settings()
+    if dims is None:
+        _, dims, _, _ = get_embedding_state(cur)
+    expression, opclass = index_expression(column, dims)
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'documents' AND indexname = %s", (index_name,))
+    row = cur.fetchone()
+    if row is not None:
+        existing = re.sub(r"[\s']", "", row[0].lower())
+        if f"using{method}(" in existing and opclass in existing and all(
+            re.search(rf"[(,]{key}={value}[,)]", existing) for key, value in params.items()
+        ):
+            return
+        print(f"Vector index settings changed, rebuilding '{index_name}'...")
+        cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index_name)))
+    else:
+        print(f"Creating {method} index on 'documents.{column}'...")
+    with_clause = ", ".join(f"{key} = {value}" for key, value in params.items())
+    cur.execute(
+        sql.SQL("CREATE INDEX {} ON documents USING {} ({} {}) WITH ({})").format(
+            sql.Identifier(index_name), sql.SQL(method), expression, sql.SQL(opclass), sql.SQL(with_clause)
+        )
+    )
+
+_iterative_scan_supported = None
+
+def supports_iterative_scan(cur) -> bool:
+    # pgvector 0.8 can keep scanning the index until enough rows pass a WHERE clause
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        cur.execute("SELECT string_to_array(extversion, '.')::int[] >= '{0,8,0}' FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        _iterative_scan_supported = bool(row and row[0])
+    return _iterative_scan_supported
+
+def vector_search_effort(limit: int, effort: int = None) -> int:
+    # The probes or ef_search a search for limit candidates actually runs with: effort overrides
+    # IVFFLAT_PROBES or HNSW_EF_SEARCH, and ef_search is raised to the limit, up to pgvector's 1000
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        return int(IVFFLAT_PROBES if effort is None else effort)
+    return min(max(int(HNSW_EF_SEARCH if effort is None else effort), limit), 1000)
+
+def configure_vector_search(cur, limit: int, filtered: bool = False, effort: int = None):
+    # Transaction-scoped so pooled connections don't leak settings between callers
+    setting = "ivfflat.probes" if VECTOR_INDEX_TYPE == "ivfflat" else "hnsw.ef_search"
+    cur.execute("SELECT set_config(%s, %s, true)", (setting, str(vector_search_effort(limit, effort))))
+    if filtered and supports_iterative_scan(cur):
+        cur.execute("SELECT set_config(%s, 'relaxed_order', true)", (f"{VECTOR_INDEX_TYPE}.iterative_scan",))
+
 def initialize_db():
     conn = connect_db()
     if not conn:
@@ -37,62 +165,14 @@ def initialize_db():
                 print("Creating 'vector' extension...")
                 cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
             
-            print("Checking if 'documents' table exists...")
-            cur.execute("SELECT to_regclass('public.documents')")
-            if cur.fetchone()[0] is None:
-                print("Creating 'documents' table...")
-                cur.execute(f"""
-                    CREATE TABLE IF NOT EXISTS documents (
-                        id SERIAL PRIMARY KEY,
-                        content TEXT,
-                        metadata JSONB,
-                        embedding vector({EMBEDDING_SIZE})
-                    )
-                """)
-                
-            print("Checking if 'feedback' table exists...")
-            cur.execute("SELECT to_regclass('public.feedback')")
-            if cur.fetchone()[0] is None:
-                print("Creating 'feedback' table...")
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS feedback (
-                        id SERIAL PRIMARY KEY,
-                        query TEXT,
-                        document_id INTEGER REFERENCES documents(id),
-                        is_relevant BOOLEAN,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-        conn.commit()
-        print("Database initialized successfully.")
-    except psycopg2.Error as e:
-        print(f"Error initializing database: {e}")
-    finally:
-        conn.close()
-
-def update_db_schema():
-    conn = connect_db()
-    if not conn:
-        print("Failed to connect to the database.")
-        return
-    try:
-        with conn.cursor() as cur:
-            # Drop the existing table
-            cur.execute("DROP TABLE IF EXISTS documents")
+            print("Checking database schema version...")
+            version = migrate_db(cur)
             
-            # Recreate the table with the new embedding size
-            cur.execute(f"""
-                CREATE TABLE documents (
-                    id SERIAL PRIMARY KEY,
-                    content TEXT,
-                    metadata JSONB,
-                    embedding vector({EMBEDDING_SIZE})
-                )
-            """)
+            ensure_vector_index(cur)
         conn.commit()
-        print("Database schema updated successfully.")
+        print(f"Database initialized successfully (schema version {version}).")
     except psycopg2.Error as e:
-        print(f"Error updating database schema: {e}")
+        print(f"Error initializing database: {e}")
         conn.rollback()
     finally:
-        conn.close()
\ No newline at end of file
+        release_db(conn)
@@ -0,0 +1,193 @@
+from psycopg2 import sql
+from config import EMBEDDING_MODEL, EMBEDDING_SIZE, TEXT_SEARCH_CONFIG
+
+# Arbitrary key so concurrent CLI/GUI startups don't apply the same migration twice
+MIGRATION_LOCK_KEY = 7305
+
+def create_base_tables(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            content TEXT,
+            metadata JSONB,
+            embedding vector({EMBEDDING_SIZE})
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS feedback (
+            id SERIAL PRIMARY KEY,
+            query TEXT,
+            document_id INTEGER REFERENCES documents(id),
+            is_relevant BOOLEAN,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def create_embedding_state(cur):
+    # Records which model/size the 'embedding' column holds, and the target of an in-flight re-embed
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_state (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            model TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            shadow_model TEXT,
+            shadow_size INTEGER
+        )
+    """)
+    cur.execute("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'documents'::regclass AND attname = 'embedding'
+    """)
+    row = cur.fetchone()
+    size = row[0] if row and row[0] > 0 else EMBEDDING_SIZE
+    cur.execute(
+        "INSERT INTO embedding_state (model, size) VALUES (%s, %s) ON CONFLICT (id) DO NOTHING",
+        (EMBEDDING_MODEL, size)
+    )
+
+def create_embedding_cache(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            embedding REAL[] NOT NULL,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (model, content_hash)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS embedding_cache_last_used_idx ON embedding_cache (last_used)")
+
+def create_sources_catalog(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sources (
+            id SERIAL PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            size BIGINT,
+            mtime DOUBLE PRECISION,
+            content_hash TEXT,
+            chunk_count INTEGER DEFAULT 0,
+            ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Existing sources get no hash, so the next directory run re-ingests them once in place
+    cur.execute("""
+        INSERT INTO sources (path, chunk_count)
+        SELECT metadata->>'source', COUNT(*) FROM documents
+        WHERE metadata->>'source' IS NOT NULL
+        GROUP BY metadata->>'source'
+        ON CONFLICT (path) DO NOTHING
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS documents_source_idx ON documents ((metadata->>'source'))")
+    # Replacing a modified file's chunks must not be blocked by feedback on the old ones
+    cur.execute("""
+        ALTER TABLE feedback
+        DROP CONSTRAINT IF EXISTS feedback_document_id_fkey,
+        ADD CONSTRAINT feedback_document_id_fkey
+            FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE SET NULL
+    """)
+
+def create_answer_cache(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            id SERIAL PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            prompt_embedding vector NOT NULL,
+            context_fingerprint TEXT NOT NULL,
+            chat_model TEXT NOT NULL,
+            embedding_model TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS answer_cache_fingerprint_idx ON answer_cache (context_fingerprint)")
+    cur.execute("CREATE INDEX IF NOT EXISTS answer_cache_last_used_idx ON answer_cache (last_used)")
+
+def add_full_text_search(cur):
+    # Generated, so every ingest path fills it without extra work
+    cur.execute(
+        sql.SQL("""
+            ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector({}, COALESCE(content, ''))) STORED
+        """).format(sql.Literal(TEXT_SEARCH_CONFIG))
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents USING gin (content_tsv)")
+
+def add_metadata_filter_indexes(cur):
+    # Backfill the filterable keys new ingests write, then index the expressions the filters compile to
+    cur.execute("""
+        UPDATE documents d
+        SET metadata = d.metadata || jsonb_build_object(
+            'type', lower(COALESCE(substring(d.metadata->>'source' from '\\.([^./]+)$'), '')),
+            'ingested_at', to_char(COALESCE(s.ingested_at, CURRENT_TIMESTAMP), 'YYYY-MM-DD"T"HH24:MI:SS')
+        )
+        FROM sources s
+        WHERE s.path = d.metadata->>'source' AND NOT d.metadata ? 'type'
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS documents_source_pattern_idx
+        ON documents ((metadata->>'source') text_pattern_ops)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS documents_ingested_at_idx ON documents ((metadata->>'ingested_at'))")
+    cur.execute("CREATE INDEX IF NOT EXISTS documents_metadata_idx ON documents USING gin (metadata jsonb_path_ops)")
+
+def link_documents_to_sources(cur):
+    cur.execute("""
+        INSERT INTO sources (path, chunk_count)
+        SELECT metadata->>'source', COUNT(*) FROM documents
+        WHERE metadata->>'source' IS NOT NULL
+        GROUP BY metadata->>'source'
+        ON CONFLICT (path) DO NOTHING
+    """)
+    cur.execute("""
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS source_id INTEGER
+        REFERENCES sources(id) ON DELETE CASCADE
+    """)
+    cur.execute("""
+        UPDATE documents d SET source_id = s.id
+        FROM sources s
+        WHERE s.path = d.metadata->>'source' AND d.source_id IS NULL
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS documents_source_id_idx ON documents (source_id)")
+
+# Append only: never edit or reorder an entry once it has shipped
+MIGRATIONS = [
+    (1, "Create documents and feedback tables", create_base_tables),
+    (2, "Track the embedding model and size", create_embedding_state),
+    (3, "Add content-addressed embedding cache", create_embedding_cache),
+    (4, "Add per-source ingestion catalog", create_sources_catalog),
+    (5, "Add semantic answer cache", create_answer_cache),
+    (6, "Add full-text search column for hybrid retrieval", add_full_text_search),
+    (7, "Add metadata filter keys and indexes", add_metadata_filter_indexes),
+    (8, "Link documents to sources with cascading delete", link_documents_to_sources),
+]
+
+def migrate_db(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current = cur.fetchone()[0]
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {description}...")
+        migrate(cur)
+        cur.execute(
+            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+            (version, description)
+        )
+    return MIGRATIONS[-1][0]
+
+def get_embedding_state(cur, for_share: bool = False):
+    # Returns (model, size, shadow_model, shadow_size); writers take FOR SHARE to hold off a column swap until commit
+    cur.execute(
+        "SELECT model, size, shadow_model, shadow_size FROM embedding_state"
+        + (" FOR SHARE" if for_share else "")
+    )
+    return cur.fetchone()
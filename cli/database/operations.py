@@ -1,9 +1,16 @@
+import os
 import psycopg2
 from psycopg2 import sql
 import psycopg2.extras
-from database.connection import connect_db
-from embedding.embed import get_embedding
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL, EMBEDDING_SIZE
+from database.connection import connect_db, release_db, ensure_vector_index
+from database.migrations import get_embedding_state
+from embedding.cache import get_embeddings_cached, evict_cache
+from retrieval.cache import bump_corpus_version
 from utils.output import colorize_output
+from utils.tracing import traced, annotate
 
 def is_file_in_database(file_path: str) -> bool:
     conn = connect_db()
@@ -12,7 +19,7 @@ def is_file_in_database(file_path: str) -> bool:
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT EXISTS(SELECT 1 FROM documents WHERE metadata->>'source' = %s)",
+                "SELECT EXISTS(SELECT 1 FROM sources WHERE path = %s AND chunk_count > 0)",
                 (file_path,)
             )
             return cur.fetchone()[0]
@@ -20,25 +27,179 @@ def is_file_in_database(file_path: str) -> bool:
         print(f"Error checking if file exists in database: {e}")
         return False
     finally:
-        conn.close()
+        release_db(conn)
         
-def store_document(content: str, metadata: dict):
+def embedding_targets(cur) -> Tuple[str, Optional[str]]:
+    # (live model, shadow model or None). During a re-embed new rows get both columns, so they are
+    # searchable right away and need no catching up at the swap. Holds off the swap until commit.
+    model, _, shadow_model, _ = get_embedding_state(cur, for_share=True)
+    return model, shadow_model
+
+@traced("embed_chunks")
+def embed_chunks(cur, chunks: List[Tuple[str, dict]], model: str, batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+    # A batch that fails to embed is reported and left empty so callers skip it
+    annotate(chunks=len(chunks))
+    embeddings = []
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        batch_embeddings = get_embeddings_cached(cur, [content for content, _ in batch], model)
+        if len(batch_embeddings) != len(batch) or not all(batch_embeddings):
+            print(f"Error embedding batch {start // batch_size} (chunks {start}-{start + len(batch) - 1}), skipping.")
+            batch_embeddings = [[] for _ in batch]
+        embeddings.extend(batch_embeddings)
+    return embeddings
+
+def ensure_source_ids(cur, paths: List[str]) -> Dict[str, int]:
+    paths = list(dict.fromkeys(path for path in paths if path))
+    if not paths:
+        return {}
+    cur.execute(
+        "INSERT INTO sources (path) SELECT unnest(%s::text[]) ON CONFLICT (path) DO NOTHING",
+        (paths,)
+    )
+    cur.execute("SELECT path, id FROM sources WHERE path = ANY(%s)", (paths,))
+    return dict(cur.fetchall())
+
+@traced("insert_chunks")
+def insert_embedded_chunks(cur, chunks: List[Tuple[str, dict]], embeddings: List[List[float]],
+                           shadow_embeddings: Optional[List[List[float]]] = None, batch_size: int = EMBEDDING_BATCH_SIZE) -> int:
+    # Chunks without a live embedding are skipped; a missing shadow embedding is left NULL for the re-embed to fill
+    source_ids = ensure_source_ids(cur, [metadata.get("source") for _, metadata in chunks])
+    rows = [
+        (content, psycopg2.extras.Json(metadata), source_ids.get(metadata.get("source")), embedding)
+        + ((shadow or None,) if shadow_embeddings is not None else ())
+        for (content, metadata), embedding, shadow in zip(chunks, embeddings, shadow_embeddings or [None] * len(chunks))
+        if embedding
+    ]
+    if rows:
+        if shadow_embeddings is None:
+            query, template = "INSERT INTO documents (content, metadata, source_id, embedding) VALUES %s", "(%s, %s, %s, %s::vector)"
+        else:
+            query = "INSERT INTO documents (content, metadata, source_id, embedding, embedding_shadow) VALUES %s"
+            template = "(%s, %s, %s, %s::vector, %s::vector)"
+        psycopg2.extras.execute_values(cur, query, rows, template=template, page_size=batch_size)
+    annotate(rows=len(rows))
+    return len(rows)
+
+def delete_source_chunks(cur, file_path: str):
+    # Indexed on documents.source_id; rows written before sources existed are matched by path
+    cur.execute(
+        """
+            DELETE FROM documents
+            WHERE source_id = (SELECT id FROM sources WHERE path = %(path)s)
+               OR (source_id IS NULL AND metadata->>'source' = %(path)s)
+        """,
+        {"path": file_path}
+    )
+
+def get_source_catalog(directory_path: str) -> Dict[str, Tuple[int, float, str]]:
+    conn = connect_db()
+    if not conn:
+        return {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT path, size, mtime, content_hash FROM sources WHERE starts_with(path, %s)",
+                (os.path.join(directory_path, ""),)
+            )
+            return {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cur.fetchall()}
+    except psycopg2.Error as e:
+        print(f"Error reading source catalog: {e}")
+        return {}
+    finally:
+        release_db(conn)
+
+def touch_source(file_path: str, size: int, mtime: float):
+    # Content is unchanged, only record the new stat so the next run skips hashing
     conn = connect_db()
     if not conn:
         return
     try:
-        embedding = get_embedding(content)
         with conn.cursor() as cur:
             cur.execute(
-                sql.SQL("INSERT INTO documents (content, metadata, embedding) VALUES (%s, %s, %s)"),
-                (content, psycopg2.extras.Json(metadata), embedding)
+                "UPDATE sources SET size = %s, mtime = %s WHERE path = %s",
+                (size, mtime, file_path)
             )
         conn.commit()
     except psycopg2.Error as e:
-        print(f"Error storing document: {e}")
+        print(f"Error updating source catalog: {e}")
+        conn.rollback()
+    finally:
+        release_db(conn)
+
+def upsert_source(cur, file_path: str, size: int, mtime: float, content_hash: str, chunk_count: int):
+    # Callers pass no hash after a partial store so the next run retries the file
+    cur.execute(
+        """
+            INSERT INTO sources (path, size, mtime, content_hash, chunk_count, ingested_at)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (path) DO UPDATE SET
+                size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash,
+                chunk_count = EXCLUDED.chunk_count, ingested_at = EXCLUDED.ingested_at
+        """,
+        (file_path, size, mtime, content_hash, chunk_count)
+    )
+
+@traced("replace_source")
+def replace_source(file_path: str, chunks: List[Tuple[str, dict]], size: int, mtime: float, content_hash: str,
+                   batch_size: int = EMBEDDING_BATCH_SIZE) -> int:
+    # Swap a file's chunks and catalog entry in one transaction so searches never see a half-indexed file.
+    # Embedding happens before that transaction, which then takes its locks in the same order as the swap.
+    model, embeddings = embed_source_chunks(chunks, batch_size)
+    return write_sources([(file_path, chunks, model, embeddings, size, mtime, content_hash)], batch_size).get(file_path, 0)
+
+def embed_source_chunks(chunks: List[Tuple[str, dict]], batch_size: int = EMBEDDING_BATCH_SIZE) -> Tuple[str, List[List[float]]]:
+    # Embedding stage of the ingestion pipeline; returns the model used so the writer can detect a column swap
+    conn = connect_db()
+    if not conn:
+        return None, [[] for _ in chunks]
+    try:
+        with conn.cursor() as cur:
+            model, _ = embedding_targets(cur)
+            conn.commit()
+            embeddings = embed_chunks(cur, chunks, model, batch_size)
+        conn.commit()
+        return model, embeddings
+    except psycopg2.Error as e:
+        print(f"Error embedding chunks: {e}")
+        conn.rollback()
+        return None, [[] for _ in chunks]
+    finally:
+        release_db(conn)
+
+@traced("write_sources")
+def write_sources(items: List[tuple], batch_size: int = EMBEDDING_BATCH_SIZE) -> Dict[str, int]:
+    # Writer stage of the ingestion pipeline: replace several embedded files in one transaction.
+    # Each item is (file_path, chunks, model, embeddings, size, mtime, content_hash).
+    annotate(files=len(items))
+    conn = connect_db()
+    if not conn:
+        return {}
+    try:
+        results = {}
+        with conn.cursor() as cur:
+            # embedding_state before documents, the order the re-embed swap takes them in, so the two can't deadlock
+            live_model, shadow_model = embedding_targets(cur)
+            for file_path, chunks, model, embeddings, size, mtime, content_hash in items:
+                if model != live_model:
+                    # The embedding column was swapped while this file was in flight
+                    embeddings = embed_chunks(cur, chunks, live_model, batch_size)
+                # The embedding stage only produces the live model's vectors; the shadow ones are added here
+                shadow_embeddings = embed_chunks(cur, chunks, shadow_model, batch_size) if shadow_model else None
+                delete_source_chunks(cur, file_path)
+                stored = insert_embedded_chunks(cur, chunks, embeddings, shadow_embeddings, batch_size)
+                upsert_source(cur, file_path, size, mtime, content_hash if stored == len(chunks) else None, stored)
+                results[file_path] = stored
+            evict_cache(cur)
+        conn.commit()
+        bump_corpus_version()
+        return results
+    except psycopg2.Error as e:
+        print(f"Error writing {len(items)} documents: {e}")
         conn.rollback()
+        return {}
     finally:
-        conn.close()
+        release_db(conn)
 
 def forget_document(file_path: str):
     conn = connect_db()
@@ -46,17 +207,20 @@ def forget_document(file_path: str):
         return
     try:
         with conn.cursor() as cur:
+            # Chunks go with their source through ON DELETE CASCADE
             cur.execute(
-                sql.SQL("DELETE FROM documents WHERE metadata->>'source' = %s"),
+                "DELETE FROM documents WHERE source_id IS NULL AND metadata->>'source' = %s",
                 (file_path,)
             )
+            cur.execute("DELETE FROM sources WHERE path = %s", (file_path,))
         conn.commit()
+        bump_corpus_version()
         print(colorize_output(f"Document '{file_path}' has been removed from the database.", "yellow"))
     except psycopg2.Error as e:
         print(f"Error removing document: {e}")
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
 
 def list_documents():
     conn = connect_db()
@@ -65,16 +229,18 @@ def list_documents():
     try:
         with conn.cursor() as cur:
             cur.execute(
-                sql.SQL("SELECT DISTINCT metadata->>'source' FROM documents")
+                sql.SQL("SELECT path, chunk_count, size, ingested_at FROM sources ORDER BY path")
             )
             documents = cur.fetchall()
         print(colorize_output("Stored documents:", "yellow"))
-        for doc in documents:
-            print(colorize_output(f"- {doc[0]}", "white"))
+        for path, chunk_count, size, ingested_at in documents:
+            size_text = f", {size / 1024:.1f} KB" if size is not None else ""
+            print(colorize_output(f"- {path} ({chunk_count} chunks{size_text}, ingested {ingested_at:%Y-%m-%d %H:%M})", "white"))
+        print(colorize_output(f"{len(documents)} documents, {sum(doc[1] or 0 for doc in documents)} chunks.", "yellow"))
     except psycopg2.Error as e:
         print(f"Error listing documents: {e}")
     finally:
-        conn.close()
+        release_db(conn)
         
 def store_feedback(query: str, document_id: int, is_relevant: bool):
     conn = connect_db()
@@ -92,5 +258,114 @@ def store_feedback(query: str, document_id: int, is_relevant: bool):
         print(f"Error storing feedback: {e}")
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
+
+def start_reembedding():
+    # Compare the configured embedding model/size with the stored one and re-embed in the background if they differ
+    conn = connect_db()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            model, size, shadow_model, shadow_size = get_embedding_state(cur)
+            target = (EMBEDDING_MODEL, EMBEDDING_SIZE)
+            if shadow_model and (shadow_model, shadow_size) != target:
+                print(colorize_output(f"Abandoning re-embed to {shadow_model} ({shadow_size} dims).", "yellow"))
+                cur.execute("ALTER TABLE documents DROP COLUMN IF EXISTS embedding_shadow")
+                cur.execute("UPDATE embedding_state SET shadow_model = NULL, shadow_size = NULL")
+                shadow_model = None
+            if (model, size) == target:
+                conn.commit()
+                return None
+            if not shadow_model:
+                print(colorize_output(f"Embedding model changed from {model} ({size} dims) to {EMBEDDING_MODEL} ({EMBEDDING_SIZE} dims).", "yellow"))
+                cur.execute(f"ALTER TABLE documents ADD COLUMN embedding_shadow vector({int(EMBEDDING_SIZE)})")
+                cur.execute(
+                    "UPDATE embedding_state SET shadow_model = %s, shadow_size = %s",
+                    target
+                )
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error preparing re-embedding: {e}")
+        conn.rollback()
+        return None
+    finally:
+        release_db(conn)
+    
+    print(colorize_output("Re-embedding documents in the background; searches use the previous embeddings until it completes.", "yellow"))
+    thread = threading.Thread(target=reembed_documents, name="reembed", daemon=True)
+    thread.start()
+    return thread
+
+def reembed_shadow_batch(cur, model: str, batch_size: int = EMBEDDING_BATCH_SIZE) -> int:
+    cur.execute(
+        "SELECT id, COALESCE(content, '') FROM documents WHERE embedding_shadow IS NULL ORDER BY id LIMIT %s",
+        (batch_size,)
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    embeddings = get_embeddings_cached(cur, [content for _, content in rows], model)
+    if len(embeddings) != len(rows) or not all(embeddings):
+        raise RuntimeError(f"failed to embed documents {rows[0][0]}-{rows[-1][0]}")
+    psycopg2.extras.execute_values(
+        cur,
+        """
+            UPDATE documents SET embedding_shadow = data.embedding
+            FROM (VALUES %s) AS data (id, embedding)
+            WHERE documents.id = data.id
+        """,
+        [(doc_id, embedding) for (doc_id, _), embedding in zip(rows, embeddings)],
+        template="(%s, %s::vector)"
+    )
+    return len(rows)
+
+def reembed_documents():
+    conn = connect_db()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            _, _, shadow_model, shadow_size = get_embedding_state(cur)
+        conn.commit()
+        if not shadow_model:
+            return
         
+        # Fill the shadow column batch by batch; progress survives restarts
+        done = 0
+        while True:
+            with conn.cursor() as cur:
+                count = reembed_shadow_batch(cur, shadow_model)
+            conn.commit()
+            if not count:
+                break
+            done += count
+        print(colorize_output(f"Re-embedded {done} documents with {shadow_model}, building index...", "yellow"))
+        
+        with conn.cursor() as cur:
+            ensure_vector_index(cur, column="embedding_shadow", index_name="documents_embedding_shadow_idx", dims=shadow_size)
+        conn.commit()
+        
+        # Swap atomically: writers hold embedding_state FOR SHARE and searches lock documents before reading it,
+        # so both see either layout whole
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM embedding_state FOR UPDATE")
+            cur.execute("LOCK TABLE documents IN ACCESS EXCLUSIVE MODE")
+            while reembed_shadow_batch(cur, shadow_model):
+                pass
+            cur.execute("ALTER TABLE documents DROP COLUMN embedding")
+            cur.execute("ALTER TABLE documents RENAME COLUMN embedding_shadow TO embedding")
+            cur.execute("ALTER INDEX documents_embedding_shadow_idx RENAME TO documents_embedding_idx")
+            cur.execute("""
+                UPDATE embedding_state
+                SET model = shadow_model, size = shadow_size, shadow_model = NULL, shadow_size = NULL
+            """)
+        conn.commit()
+        bump_corpus_version()
+        print(colorize_output(f"Switched searches to {shadow_model} embeddings.", "yellow"))
+    except (psycopg2.Error, RuntimeError) as e:
+        print(f"Re-embedding interrupted, it will resume on next start: {e}")
+        if not conn.closed:
+            conn.rollback()
+    finally:
+        release_db(conn)
@@ -1,7 +1,11 @@
 import os
+import hashlib
+from datetime import datetime
 from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader, PyPDFLoader, DirectoryLoader
+from config import CHUNK_SIZE, CHUNK_OVERLAP
 from document_processing.splitter import split_text
-from database.operations import store_document
+from storage.store import get_store
+from utils.paths import normalize_path
 import traceback
 import emoji
 
@@ -14,12 +18,31 @@ def get_loader_for_file(file_path):
     else:
         return TextLoader(file_path, encoding='utf-8')
 
+def chunk_metadata(file_path: str, chunks):
+    # type and ingested_at back the search filters (see retrieval/filters.py)
+    file_type = os.path.splitext(file_path)[1].lower().lstrip(".")
+    ingested_at = datetime.now().isoformat(timespec="seconds")
+    return [
+        (chunk.page_content, {"source": file_path, "chunk_index": i, "type": file_type, "ingested_at": ingested_at})
+        for i, chunk in enumerate(chunks)
+    ]
+
+def load_chunks(file_path: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    documents = get_loader_for_file(file_path).load()
+    return chunk_metadata(file_path, split_text(documents, chunk_size, chunk_overlap))
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 def process_document(file_path: str):
     print(f"Debug: Starting to process document: {file_path}")
     
     file_path = file_path.strip().strip("\"'")
-    file_path = os.path.expanduser(os.path.expandvars(file_path))
-    file_path = file_path.replace("\\", "")
+    file_path = normalize_path(file_path.replace("\\", ""))
     
     print(f"Debug: Processed file path: {file_path}")
     
@@ -51,13 +74,10 @@ def process_document(file_path: str):
         
         print(f"Debug: Split content into {len(chunks)} chunks")
         
-        successful_chunks = 0
-        for i, chunk in enumerate(chunks):
-            try:
-                store_document(chunk.page_content, {"source": file_path, "chunk_index": i})
-                successful_chunks += 1
-            except Exception as e:
-                print(f"Error storing chunk {i}: {e}")
+        stat = os.stat(file_path)
+        successful_chunks = get_store().replace_source(
+            file_path, chunk_metadata(file_path, chunks), stat.st_size, stat.st_mtime, file_hash(file_path)
+        )
         
         print(f"Processed file: {file_path}. Successfully stored {successful_chunks} out of {len(chunks)} chunks.")
         print(emoji.emojize(":star:"))
@@ -65,43 +85,3 @@ def process_document(file_path: str):
         print(f"Error processing file: {e}")
         print(f"Debug: Exception type: {type(e)}")
         print(f"Stack trace: {traceback.format_exc()}")
-        
-def process_directory(directory_path: str):
-    print(f"Debug: Starting to process directory: {directory_path}")
-    directory_path = os.path.expanduser(os.path.expandvars(directory_path))
-    if not os.path.exists(directory_path):
-        print(f"Error: Directory does not exist at path: {directory_path}")
-        return
-    
-    try:
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    if file.lower().endswith('.md'):
-                        loader = UnstructuredMarkdownLoader(file_path)
-                    else:
-                        # Skip non-markdown files
-                        print(f"Skipping non-markdown file: {file_path}")
-                        continue
-                    
-                    documents = loader.load()
-                    
-                    chunks = split_text(documents)
-                    
-                    for i, chunk in enumerate(chunks):
-                        try:
-                            store_document(chunk.page_content, {"source": file_path, "chunk_index": i})
-                        except Exception as e:
-                            print(f"Error storing chunk {i} from {file_path}: {e}")
-                    
-                    print(f"Processed file: {file_path}")
-                except Exception as e:
-                    print(f"Error processing file {file_path}: {e}")
-        
-        print(f"Finished processing directory: {directory_path}")
-        print(emoji.emojize(":star:"))
-    except Exception as e:
-        print(f"Error processing directory: {e}")
-        print(f"Debug: Exception type: {type(e)}")
-        print(f"Stack trace: {traceback.format_exc()}")
\ No newline at end of file
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import emoji
+from config import INGEST_WORKERS, INGEST_WRITER_BATCH_FILES
+from document_processing.loader import load_chunks, file_hash
+from storage.store import get_store
+from utils.paths import normalize_path
+
+# Parsing and splitting run in worker processes, embedding in threads (they wait on Ollama),
+# and a single writer thread groups finished files into one store write. Bounded queues
+# between the stages stop parsing from running ahead of embedding.
+
+def parse_file(file_path: str, size: int, mtime: float, content_hash: str):
+    try:
+        return file_path, load_chunks(file_path), size, mtime, content_hash, None
+    except Exception as e:
+        return file_path, [], size, mtime, content_hash, str(e)
+
+def embed_stage(parsed: queue.Queue, embedded: queue.Queue):
+    while True:
+        item = parsed.get()
+        if item is None:
+            break
+        file_path, chunks, size, mtime, content_hash, error = item
+        if error:
+            print(f"Error processing file {file_path}: {error}")
+            continue
+        try:
+            model, embeddings = get_store().embed_source_chunks(chunks)
+        except Exception as e:
+            print(f"Error embedding file {file_path}: {e}")
+            continue
+        embedded.put((file_path, chunks, model, embeddings, size, mtime, content_hash))
+
+def write_stage(embedded: queue.Queue, results: dict, known: set, max_files: int):
+    done = False
+    while not done:
+        items = [embedded.get()]
+        # Drain whatever else is ready into the same write
+        while len(items) < max_files:
+            try:
+                items.append(embedded.get_nowait())
+            except queue.Empty:
+                break
+        if None in items:
+            done = True
+            items = [item for item in items if item is not None]
+        if not items:
+            continue
+        stored = get_store().write_sources(items)
+        for file_path, chunks, *_ in items:
+            if file_path not in stored:
+                print(f"Error storing file {file_path}.")
+                continue
+            results[file_path] = stored[file_path]
+            print(f"{'Updated' if file_path in known else 'Processed'} file: {file_path}. Stored {stored[file_path]} out of {len(chunks)} chunks.")
+
+def find_changed_files(directory_path: str, catalog: dict):
+    # Only new or modified markdown files need ingesting; unchanged ones are decided from stat, then hash
+    changed = []
+    skipped = 0
+    for root, _, files in os.walk(directory_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if not file.lower().endswith('.md'):
+                # Skip non-markdown files
+                print(f"Skipping non-markdown file: {file_path}")
+                continue
+            try:
+                stat = os.stat(file_path)
+                known = catalog.get(file_path)
+                if known and known[2] and known[0] == stat.st_size and known[1] == stat.st_mtime:
+                    skipped += 1
+                    continue
+                content_hash = file_hash(file_path)
+                if known and known[2] == content_hash:
+                    get_store().touch_source(file_path, stat.st_size, stat.st_mtime)
+                    skipped += 1
+                    continue
+                changed.append((file_path, stat.st_size, stat.st_mtime, content_hash))
+            except OSError as e:
+                print(f"Error processing file {file_path}: {e}")
+    return changed, skipped
+
+def run_pipeline(files, workers: int, known: set) -> dict:
+    parsed = queue.Queue(maxsize=workers * 2)
+    embedded = queue.Queue(maxsize=workers * 2)
+    results = {}
+
+    # Spawned rather than forked: the interactive CLI already runs the metrics, re-embed and warmup threads,
+    # and a forked child could inherit locks they hold
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        embedders = [
+            threading.Thread(target=embed_stage, args=(parsed, embedded), name=f"embed-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        writer = threading.Thread(
+            target=write_stage, args=(embedded, results, known, INGEST_WRITER_BATCH_FILES), name="writer", daemon=True
+        )
+        for thread in embedders + [writer]:
+            thread.start()
+
+        try:
+            pending = set()
+            for file_info in files:
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        # Blocks while the embedders are behind, which in turn stops new parses
+                        parsed.put(future.result())
+                pending.add(pool.submit(parse_file, *file_info))
+            for future in wait(pending).done:
+                parsed.put(future.result())
+        finally:
+            # Even when parsing failed, so the threads finish what they have and the error reaches the caller
+            for _ in embedders:
+                parsed.put(None)
+            for thread in embedders:
+                thread.join()
+            embedded.put(None)
+            writer.join()
+    return results
+
+def process_directory(directory_path: str, workers: int = INGEST_WORKERS):
+    print(f"Debug: Starting to process directory: {directory_path}")
+    directory_path = normalize_path(directory_path)
+    if not os.path.exists(directory_path):
+        print(f"Error: Directory does not exist at path: {directory_path}")
+        return
+
+    try:
+        start = time.perf_counter()
+        catalog = get_store().get_source_catalog(directory_path)
+        changed, skipped = find_changed_files(directory_path, catalog)
+        print(f"Found {len(changed)} new or modified files, skipping {skipped} unchanged files.")
+
+        results = run_pipeline(changed, max(1, workers), set(catalog)) if changed else {}
+
+        # Files gone from disk are forgotten
+        for file_path in catalog:
+            if not os.path.exists(file_path):
+                get_store().forget_document(file_path)
+
+        elapsed = time.perf_counter() - start
+        print(f"Stored {sum(results.values())} chunks from {len(results)} files in {elapsed:.1f}s using {workers} workers.")
+        print(f"Finished processing directory: {directory_path}")
+        print(emoji.emojize(":star:"))
+    except Exception as e:
+        print(f"Error processing directory: {e}")
+        print(f"Debug: Exception type: {type(e)}")
+        print(f"Stack trace: {traceback.format_exc()}")
@@ -1,5 +1,6 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from config import CHUNK_SIZE, CHUNK_OVERLAP
 
-def split_text(documents):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=350, chunk_overlap=30)
-    return text_splitter.split_documents(documents)
\ No newline at end of file
+def split_text(documents, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(documents)
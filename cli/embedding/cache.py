@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from typing import List
+import psycopg2.extras
+from config import EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MAX_ENTRIES
+from embedding.embed import get_embedding
+
+# The cache size is only counted once this many entries were added since the last count
+EVICTION_CHECK_INTERVAL = 1000
+
+_stats_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# Entries inserted by this process since evict_cache last counted; None until the first count
+_inserted_since_check = None
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def record_stats(**counts):
+    with _stats_lock:
+        for key, value in counts.items():
+            cache_stats[key] += value
+
+def get_embeddings_cached(cur, texts: List[str], model: str) -> List[List[float]]:
+    # Look up (model, sha256(text)) in embedding_cache and only send misses to Ollama
+    if not EMBEDDING_CACHE_ENABLED:
+        return get_embedding(texts, model=model)
+
+    hashes = [content_hash(text) for text in texts]
+    cur.execute(
+        """
+            UPDATE embedding_cache SET last_used = CURRENT_TIMESTAMP
+            WHERE model = %s AND content_hash = ANY(%s)
+            RETURNING content_hash, embedding
+        """,
+        (model, sorted(set(hashes)))
+    )
+    found = dict(cur.fetchall())
+
+    missing = {}
+    for text, digest in zip(texts, hashes):
+        if digest not in found:
+            missing.setdefault(digest, text)
+    hits = sum(1 for digest in hashes if digest in found)
+    record_stats(hits=hits, misses=len(texts) - hits)
+
+    if missing:
+        embeddings = get_embedding(list(missing.values()), model=model)
+        # Sorted so concurrent embedders lock the same rows in the same order and cannot deadlock
+        fresh = sorted(
+            (model, digest, embedding)
+            for digest, embedding in zip(missing.keys(), embeddings)
+            if embedding
+        )
+        if fresh:
+            record_inserts(len(fresh))
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                    INSERT INTO embedding_cache (model, content_hash, embedding) VALUES %s
+                    ON CONFLICT (model, content_hash) DO UPDATE SET last_used = CURRENT_TIMESTAMP
+                """,
+                fresh
+            )
+            found.update((digest, embedding) for _, digest, embedding in fresh)
+
+    return [found.get(digest, []) for digest in hashes]
+
+def record_inserts(count: int):
+    global _inserted_since_check
+    with _stats_lock:
+        if _inserted_since_check is not None:
+            _inserted_since_check += count
+
+def evict_cache(cur, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES) -> int:
+    # Drop least recently used entries beyond the configured size. Counting the table is a full scan,
+    # so it happens on the first call and then only after EVICTION_CHECK_INTERVAL new entries.
+    global _inserted_since_check
+    if not EMBEDDING_CACHE_ENABLED:
+        return 0
+    with _stats_lock:
+        if _inserted_since_check is not None and _inserted_since_check < EVICTION_CHECK_INTERVAL:
+            return 0
+        _inserted_since_check = 0
+    cur.execute("SELECT COUNT(*) FROM embedding_cache")
+    excess = cur.fetchone()[0] - max_entries
+    if excess <= 0:
+        return 0
+    cur.execute(
+        """
+            DELETE FROM embedding_cache WHERE (model, content_hash) IN (
+                SELECT model, content_hash FROM embedding_cache
+                ORDER BY last_used
+                LIMIT %s
+            )
+        """,
+        (excess,)
+    )
+    record_stats(evictions=cur.rowcount)
+    return cur.rowcount
@@ -1,17 +1,37 @@
 from typing import List, Union
-import ollama
-from config import EMBEDDING_MODEL
+from config import EMBEDDING_MODEL, OLLAMA_KEEP_ALIVE
+from utils.tracing import traced, annotate
 
-def get_embedding(text: Union[str, List[str]]) -> Union[List[float], List[List[float]]]:
+@traced("embed")
+def get_embedding(text: Union[str, List[str]], model: str = EMBEDDING_MODEL) -> Union[List[float], List[List[float]]]:
+    # ollama is imported on first use; it is not needed until the first embedding and slows startup
+    import ollama
+    annotate(texts=1 if isinstance(text, str) else len(text))
     try:
         if isinstance(text, str):
-            response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=text)
+            response = ollama.embeddings(model=model, prompt=text, keep_alive=OLLAMA_KEEP_ALIVE)
             return response['embedding']
         elif isinstance(text, list):
-            response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=text)
-            return [item['embedding'] for item in response['embeddings']]
+            if not text:
+                return []
+            response = ollama.embed(model=model, input=text, keep_alive=OLLAMA_KEEP_ALIVE)
+            return response['embeddings']
         else:
             raise ValueError("Input must be a string or a list of strings")
     except Exception as e:
         print(f"Error generating embedding: {e}")
-        return [] if isinstance(text, str) else [[] for _ in text]
\ No newline at end of file
+        return [] if isinstance(text, str) else [[] for _ in text]
+
+@traced("embed")
+async def get_embedding_async(texts: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    # Embeds every text in one request without blocking the event loop
+    import ollama
+    annotate(texts=len(texts))
+    if not texts:
+        return []
+    try:
+        response = await ollama.AsyncClient().embed(model=model, input=texts, keep_alive=OLLAMA_KEEP_ALIVE)
+        return response['embeddings']
+    except Exception as e:
+        print(f"Error generating embedding: {e}")
+        return [[] for _ in texts]
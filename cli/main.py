@@ -1,25 +1,116 @@
+from utils.startup import StartupProfile
+profile = StartupProfile()
+
+import argparse
 import os
-from database.connection import initialize_db, update_db_schema
-from database.operations import store_document, forget_document, list_documents
-from document_processing.loader import process_document, process_directory
-from retrieval.similarity import search_documents
-from chat.ollama_chat import recall, stream_response
+from config import INGEST_WORKERS, BATCH_WORKERS, STORAGE_BACKEND, WARMUP_ON_START, METRICS_PORT, EVAL_K
+from storage.store import get_store
+from retrieval.filters import parse_filters, describe_filters
 from utils.output import colorize_output
+from utils.paths import normalize_path
+
+# Command modules pull in langchain, ollama and the chat stack, so they are imported by the
+# command that first needs them (or by the warm-up) instead of before the prompt appears.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local RAG AI Agent. Without a command, starts the interactive prompt.")
+    parser.add_argument("--startup-profile", action="store_true", help="print how long each startup stage took")
+    commands = parser.add_subparsers(dest="command")
+
+    ask = commands.add_parser("ask", help="answer one question and exit")
+    ask.add_argument("question")
+    ask.add_argument("--filter", default="", help="restrict context, e.g. 'type:pdf dir:~/notes after:2024-06-01'")
+    ask.add_argument("--no-cache", action="store_true", help="do not use the answer cache")
+
+    search = commands.add_parser("search", help="print the documents most relevant to a query")
+    search.add_argument("query", help="may contain source:, dir:, type:, after: and before: filters")
+
+    ingest = commands.add_parser("ingest", help="add a document, or every markdown document in a directory")
+    ingest.add_argument("path")
+    ingest.add_argument("--workers", type=int, default=INGEST_WORKERS)
+
+    batch = commands.add_parser("batch", help="answer every prompt in a JSONL file (see chat/batch.py for the format)")
+    batch.add_argument("input")
+    batch.add_argument("-o", "--output", required=True, help="JSONL file receiving one result per input line")
+    batch.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    batch.add_argument("--resume", action="store_true", help="append to the output, skipping lines it already answers")
+    batch.add_argument("--no-cache", action="store_true", help="do not use the answer cache")
+
+    evaluate = commands.add_parser("evaluate", help="measure retrieval quality and latency of search settings against recorded feedback")
+    evaluate.add_argument("-k", type=int, default=EVAL_K, help="cutoff for recall@k and MRR")
+    evaluate.add_argument("--limits", type=int, nargs="+", help="candidate limits to try")
+    evaluate.add_argument("--efforts", type=int, nargs="+", help="hnsw.ef_search or ivfflat.probes values to try")
+    evaluate.add_argument("--chunk-sizes", type=int, nargs="+", help="also re-chunk and re-embed every document at these sizes (slow)")
+    evaluate.add_argument("-o", "--output", help="write the results as JSON")
+    return parser.parse_args()
+
+def run_command(args):
+    if args.command == "ask":
+        from chat.ollama_chat import answer
+        _, filters = parse_filters(args.filter)
+        answer(args.question, filters=filters, use_cache=not args.no_cache)
+    elif args.command == "search":
+        from retrieval.similarity import search_documents
+        search_documents(args.query)
+    elif args.command == "ingest":
+        path = normalize_path(args.path)
+        if os.path.isdir(path):
+            from document_processing.pipeline import process_directory
+            process_directory(path, workers=args.workers)
+        else:
+            from document_processing.loader import process_document
+            process_document(path)
+    elif args.command == "batch":
+        from chat.batch import run_batch
+        run_batch(args.input, args.output, workers=args.workers, resume=args.resume, use_cache=not args.no_cache)
+    elif args.command == "evaluate":
+        if STORAGE_BACKEND == "postgres":
+            from retrieval.evaluation import evaluate_retrieval
+            evaluate_retrieval(args.limits, args.efforts, args.k, args.chunk_sizes, args.output)
+        else:
+            print(colorize_output("evaluate reads the feedback table and needs STORAGE_BACKEND = 'postgres'.", "yellow"))
 
 def main():
-    initialize_db()
-    update_db_schema()
+    args = parse_args()
+    profile.mark("imports")
+    if METRICS_PORT:
+        from utils.tracing import start_metrics_server
+        start_metrics_server(METRICS_PORT)
+    store = get_store()
+    store.initialize()
+    profile.mark("storage")
+    if args.command:
+        # One-shot commands leave any pending re-embed to the next interactive start
+        if args.startup_profile:
+            profile.report()
+        run_command(args)
+        store.close()
+        return
+    store.start_reembedding()
+    profile.mark("re-embed check")
+    if WARMUP_ON_START:
+        from chat.warmup import start_warmup
+        start_warmup(report=args.startup_profile)
+        profile.mark("warm-up start")
     
     print(colorize_output("Welcome to the Local RAG AI Agent!", "yellow"))
     print(colorize_output("Commands:", "yellow"))
     print(colorize_output("- 'exit' to quit", "white"))
     print(colorize_output("- 'process' to add a document", "white"))
-    print(colorize_output("- 'process_dir' to add all documents in a directory", "white"))
+    print(colorize_output("- 'process_dir [--workers N]' to add all documents in a directory", "white"))
     print(colorize_output("- 'forget' to remove a document", "white"))
     print(colorize_output("- 'list' to show all stored documents", "white"))
     print(colorize_output("- 'search' to find relevant documents", "white"))
+    print(colorize_output("- 'filter source:<glob> dir:<path> type:<ext> after:<date> before:<date>' to restrict search and answers ('filter' alone clears)", "white"))
+    print(colorize_output("- 'nocache <question>' to ask without using the answer cache", "white"))
+    print(colorize_output("- 'clear_cache' to empty the answer cache", "white"))
+    print(colorize_output("- 'storage_report' to compare index size and recall of full, halfvec and binary storage", "white"))
+    print(colorize_output("- 'evaluate' to compare recall and latency of search settings against recorded feedback", "white"))
     print(colorize_output("- Or simply ask a question", "white"))
+    if args.startup_profile:
+        profile.report()
     
+    filters = []
     while True:
         user_input = input(colorize_output("You: ", "white"))
         
@@ -27,21 +118,55 @@ def main():
             break
         elif user_input.lower() == 'process':
             file_path = input(colorize_output("Enter the path to the document: ", "white"))
+            from document_processing.loader import process_document
             process_document(file_path)
-        elif user_input.lower() == 'process_dir':
+        elif user_input.lower().split()[:1] == ['process_dir']:
+            words = user_input.split()
+            workers = INGEST_WORKERS
+            if '--workers' in words[1:-1]:
+                try:
+                    workers = int(words[words.index('--workers') + 1])
+                except ValueError:
+                    print(colorize_output("--workers expects a number, using the default.", "yellow"))
             dir_path = input(colorize_output("Enter the path to the directory: ", "white"))
-            process_directory(dir_path)
+            from document_processing.pipeline import process_directory
+            process_directory(dir_path, workers=workers)
         elif user_input.lower() == 'forget':
             file_path = input(colorize_output("Enter the path of the document to forget: ", "white"))
-            forget_document(file_path)
+            store.forget_document(normalize_path(file_path.strip().strip("\"'")))
         elif user_input.lower() == 'list':
-            list_documents()
+            store.list_documents()
         elif user_input.lower() == 'search':
             query = input(colorize_output("Enter your search query: ", "white"))
-            search_documents(query)
+            from retrieval.similarity import search_documents
+            search_documents(query, filters=filters)
+        elif user_input.lower().split()[:1] == ['filter']:
+            _, filters = parse_filters(user_input[len('filter'):])
+            print(colorize_output(f"Filters: {describe_filters(filters)}" if filters else "Filters cleared.", "yellow"))
+        elif user_input.lower() == 'clear_cache':
+            from chat.answer_cache import clear_answer_cache
+            clear_answer_cache()
+        elif user_input.lower() == 'storage_report':
+            if STORAGE_BACKEND == 'postgres':
+                from retrieval.quantization import compare_storage_modes
+                compare_storage_modes()
+            else:
+                print(colorize_output("storage_report compares pgvector storage modes and needs STORAGE_BACKEND = 'postgres'.", "yellow"))
+        elif user_input.lower() == 'evaluate':
+            if STORAGE_BACKEND == 'postgres':
+                from retrieval.evaluation import evaluate_retrieval
+                evaluate_retrieval()
+            else:
+                print(colorize_output("evaluate reads the feedback table and needs STORAGE_BACKEND = 'postgres'.", "yellow"))
+        elif user_input.lower().startswith('nocache '):
+            prompt = user_input[len('nocache '):]
+            from chat.ollama_chat import answer
+            answer(prompt, filters=filters, use_cache=False)
         else:
-            context = recall(user_input)
-            response = stream_response(user_input, context)
+            from chat.ollama_chat import answer
+            answer(user_input, filters=filters)
+    
+    store.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+from config import QUERY_CACHE_SIZE, RESULT_CACHE_SIZE
+
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# (model, query text) -> embedding
+query_embeddings = LRUCache(QUERY_CACHE_SIZE)
+# (model, query embedding, query text if hybrid, limit, corpus version) -> result rows
+search_results = LRUCache(RESULT_CACHE_SIZE)
+
+_corpus_version = 0
+_version_lock = threading.Lock()
+
+def corpus_version() -> int:
+    return _corpus_version
+
+def bump_corpus_version():
+    # Called after any committed change to the documents table in this process
+    global _corpus_version
+    with _version_lock:
+        _corpus_version += 1
+        search_results.clear()
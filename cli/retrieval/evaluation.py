@@ -0,0 +1,265 @@
+import itertools
+import json
+import os
+import tempfile
+import time
+from difflib import SequenceMatcher
+from typing import Dict, List, Tuple
+import psycopg2
+from config import (
+    EVAL_K, EVAL_CANDIDATE_LIMITS, EVAL_EF_SEARCH, EVAL_PROBES, EVAL_QUALITY_TOLERANCE,
+    VECTOR_INDEX_TYPE, HNSW_EF_SEARCH, IVFFLAT_PROBES, HYBRID_SEARCH, HYBRID_CANDIDATES, RERANK_CANDIDATES,
+    CHUNK_SIZE, CHUNK_OVERLAP
+)
+from database.connection import connect_db, release_db, vector_search_effort
+from retrieval.similarity import vector_search, hybrid_search, rerank_documents, get_reranker, rescore_limit
+from storage.store import get_store
+from utils.output import colorize_output
+
+# Feedback rows become relevance judgments: for each query, the chunks last marked relevant.
+# Every configuration searches the same judged queries with the same query embeddings, so the
+# latencies cover search and reranking only. Searches go to pgvector directly, past the result cache.
+
+def load_judgments() -> List[Tuple[str, Dict[str, str]]]:
+    # [(query, {relevant chunk content: source})]; the latest verdict per query and chunk wins
+    conn = connect_db()
+    if not conn:
+        return []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT f.query, d.content, d.metadata->>'source'
+                FROM (
+                    SELECT DISTINCT ON (query, document_id) query, document_id, is_relevant
+                    FROM feedback
+                    WHERE document_id IS NOT NULL AND query IS NOT NULL
+                    ORDER BY query, document_id, timestamp DESC, id DESC
+                ) f
+                JOIN documents d ON d.id = f.document_id
+                WHERE f.is_relevant
+                ORDER BY f.query
+            """)
+            rows = cur.fetchall()
+            # Re-ingesting or forgetting a file deletes its chunks and nulls document_id on their feedback
+            cur.execute("SELECT COUNT(*) FROM feedback WHERE is_relevant AND document_id IS NULL AND query IS NOT NULL")
+            (orphaned,) = cur.fetchone()
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error reading feedback: {e}")
+        conn.rollback()
+        return []
+    finally:
+        release_db(conn)
+    if orphaned:
+        print(colorize_output(
+            f"Skipped {orphaned} relevant verdicts on chunks that were re-ingested or removed since; "
+            "record feedback again to judge the current chunks.", "yellow"
+        ))
+    judgments = {}
+    for query, content, source in rows:
+        judgments.setdefault(query, {})[content] = source
+    return list(judgments.items())
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+def overlaps(a: str, b: str) -> bool:
+    # Chunks cut at different sizes match when they share at least half of the shorter one
+    match = SequenceMatcher(None, a, b, autojunk=False).find_longest_match(0, len(a), 0, len(b))
+    return match.size >= min(len(a), len(b)) / 2
+
+def score_results(retrieved: List[str], relevant: List[str], k: int, match=str.__eq__) -> Tuple[float, float]:
+    # (recall@k, reciprocal rank of the first relevant result within the top k)
+    top = retrieved[:k]
+    found = sum(any(match(doc, judged) for doc in top) for judged in relevant)
+    rank = next((i + 1 for i, doc in enumerate(top) if any(match(doc, judged) for judged in relevant)), None)
+    return found / len(relevant), 1 / rank if rank else 0.0
+
+def summarize(recalls: List[float], ranks: List[float], latencies: List[float]) -> dict:
+    return {
+        "recall": sum(recalls) / len(recalls), "mrr": sum(ranks) / len(ranks),
+        "p50_ms": percentile(latencies, 50) * 1000, "p95_ms": percentile(latencies, 95) * 1000
+    }
+
+def evaluate_configuration(judgments, embeddings, limit: int, effort: int, hybrid: bool, rerank: bool, k: int) -> dict:
+    recalls, ranks, latencies = [], [], []
+    conn = connect_db()
+    if not conn:
+        return None
+    try:
+        for (query, relevant), embedding in zip(judgments, embeddings):
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                if hybrid:
+                    results = hybrid_search(cur, query, embedding, limit, effort=effort)
+                else:
+                    results = vector_search(cur, embedding, limit, effort=effort)
+            conn.rollback()
+            if rerank:
+                results = rerank_documents(query, results, top_k=k)
+            latencies.append(time.perf_counter() - start)
+            recall, reciprocal_rank = score_results([content for content, _ in results], list(relevant), k)
+            recalls.append(recall)
+            ranks.append(reciprocal_rank)
+    except psycopg2.Error as e:
+        print(f"Error evaluating limit {limit}, effort {effort}: {e}")
+        conn.rollback()
+        return None
+    finally:
+        release_db(conn)
+    return summarize(recalls, ranks, latencies)
+
+def rechunked_store(directory: str, paths: List[str], chunk_size: int):
+    # A throwaway local store holding the catalog's documents split at chunk_size
+    from document_processing.loader import load_chunks
+    from storage.local import LocalStore
+    store = LocalStore(directory)
+    store.initialize()
+    chunk_overlap = round(chunk_size * CHUNK_OVERLAP / CHUNK_SIZE)
+    for path in paths:
+        try:
+            chunks = load_chunks(path, chunk_size, chunk_overlap)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            continue
+        model, embeddings = store.embed_source_chunks(chunks)
+        store.write_sources([(path, chunks, model, embeddings, None, None, None)])
+    return store
+
+def evaluate_chunk_sizes(judgments, embeddings, chunk_sizes: List[int], limit: int, k: int) -> List[dict]:
+    # Chunk size is fixed at ingestion, so each size re-splits and re-embeds every cataloged document
+    # into a temporary local store. Results match judgments by text overlap, and latencies are exact
+    # in-memory scans, comparable between sizes but not with the pgvector rows.
+    conn = connect_db()
+    if not conn:
+        return []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT path FROM sources ORDER BY path")
+            paths = [path for (path,) in cur.fetchall() if os.path.exists(path)]
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error reading the source catalog: {e}")
+        conn.rollback()
+        return []
+    finally:
+        release_db(conn)
+
+    rows = []
+    for chunk_size in chunk_sizes:
+        print(colorize_output(f"Re-chunking {len(paths)} documents at {chunk_size} characters...", "yellow"))
+        with tempfile.TemporaryDirectory(prefix="eval-chunks-") as directory:
+            store = rechunked_store(directory, paths, chunk_size)
+            model = store.embedding_model()
+            for rerank in (True, False):
+                recalls, ranks, latencies = [], [], []
+                for (query, relevant), embedding in zip(judgments, embeddings):
+                    start = time.perf_counter()
+                    results = store.search(query, embedding, model, limit)
+                    if rerank:
+                        results = rerank_documents(query, results, top_k=k)
+                    latencies.append(time.perf_counter() - start)
+                    recall, reciprocal_rank = score_results([content for content, _ in results], list(relevant), k, overlaps)
+                    recalls.append(recall)
+                    ranks.append(reciprocal_rank)
+                rows.append({"chunk_size": chunk_size, "limit": limit, "rerank": rerank, **summarize(recalls, ranks, latencies)})
+            store.close()
+    return rows
+
+def describe(row: dict, effort_name: str) -> str:
+    settings = [f"limit {row['limit']}"]
+    if "chunk_size" in row:
+        settings.insert(0, f"chunk size {row['chunk_size']}")
+    else:
+        requested = ", ".join(str(effort) for effort in row["requested_efforts"] if effort != row["effort"])
+        settings += [
+            f"{effort_name} {row['effort']}" + (f" (requested {requested})" if requested else ""),
+            "hybrid" if row["hybrid"] else "vector only"
+        ]
+    settings.append("rerank" if row["rerank"] else "no rerank")
+    return ", ".join(settings)
+
+def print_rows(rows: List[dict], k: int, effort_name: str, current=None):
+    # Fastest first; the recommendation is the fastest row within EVAL_QUALITY_TOLERANCE of the best recall
+    best = max(row["recall"] for row in rows)
+    recommended = min(
+        (row for row in rows if row["recall"] >= best - EVAL_QUALITY_TOLERANCE), key=lambda row: row["p95_ms"]
+    )
+    for row in sorted(rows, key=lambda row: row["p95_ms"]):
+        markers = [label for label, flag in (("recommended", row is recommended), ("current", row is current)) if flag]
+        print(colorize_output(
+            f"- {describe(row, effort_name)}: recall@{k} {row['recall']:.3f}, MRR {row['mrr']:.3f}, "
+            f"p50 {row['p50_ms']:.1f} ms, p95 {row['p95_ms']:.1f} ms" + (f" ({', '.join(markers)})" if markers else ""),
+            "green" if row is recommended else "white"
+        ))
+
+def evaluate_retrieval(limits: List[int] = None, efforts: List[int] = None, k: int = EVAL_K,
+                       chunk_sizes: List[int] = None, output: str = None):
+    # Sweeps candidate limit x index effort x hybrid x rerank, plus optional chunk sizes, and prints
+    # recall@k and MRR against p50/p95 latency. The current configuration is always included.
+    judgments = load_judgments()
+    if not judgments:
+        print(colorize_output("No relevance feedback recorded yet; the feedback table needs rows marked relevant.", "yellow"))
+        return None
+    store = get_store()
+    model = store.embedding_model()
+    if not model:
+        return None
+    embeddings = store.embed_queries([query for query, _ in judgments], model)
+    judged = [(judgment, embedding) for judgment, embedding in zip(judgments, embeddings) if embedding]
+    judgments, embeddings = [judgment for judgment, _ in judged], [embedding for _, embedding in judged]
+    if not judgments:
+        print(colorize_output("Could not embed the judged queries.", "yellow"))
+        return None
+
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        effort_name, configured_effort, default_efforts = "probes", IVFFLAT_PROBES, EVAL_PROBES
+    else:
+        effort_name, configured_effort, default_efforts = "ef_search", HNSW_EF_SEARCH, EVAL_EF_SEARCH
+    limits = sorted(set(limits or EVAL_CANDIDATE_LIMITS) | {RERANK_CANDIDATES})
+    efforts = sorted(set(efforts or default_efforts) | {configured_effort})
+    # ef_search is raised to each search's candidate count, so several requested values can run as the
+    # same search; each distinct (limit, effective effort, hybrid, rerank) is evaluated once
+    plan = {}
+    for limit, effort, hybrid, rerank in itertools.product(limits, efforts, (True, False), (True, False)):
+        applied = vector_search_effort(rescore_limit(max(HYBRID_CANDIDATES, limit) if hybrid else limit), effort)
+        plan.setdefault((limit, applied, hybrid, rerank), []).append(effort)
+    relevant = sum(len(relevant) for _, relevant in judgments)
+    print(colorize_output(
+        f"Evaluating {len(plan)} configurations on {len(judgments)} judged queries "
+        f"({relevant} relevant chunks)...", "yellow"
+    ))
+    # Load the reranker before anything is timed
+    get_reranker()
+
+    rows, current = [], None
+    for (limit, applied, hybrid, rerank), requested in plan.items():
+        result = evaluate_configuration(judgments, embeddings, limit, applied, hybrid, rerank, k)
+        if result is None:
+            continue
+        row = {"limit": limit, "effort": applied, "requested_efforts": requested, "hybrid": hybrid, "rerank": rerank, **result}
+        rows.append(row)
+        if (limit, hybrid, rerank) == (RERANK_CANDIDATES, HYBRID_SEARCH, True) and configured_effort in requested:
+            current = row
+    if not rows:
+        return None
+    print(colorize_output(f"\nSearch configurations ({VECTOR_INDEX_TYPE} index, {effort_name}):", "yellow"))
+    print_rows(rows, k, effort_name, current)
+
+    chunk_rows = []
+    if chunk_sizes:
+        chunk_rows = evaluate_chunk_sizes(judgments, embeddings, sorted(set(chunk_sizes)), RERANK_CANDIDATES, k)
+        if chunk_rows:
+            print(colorize_output(f"\nChunk sizes (exact local search, limit {RERANK_CANDIDATES}, current {CHUNK_SIZE}):", "yellow"))
+            print_rows(chunk_rows, k, effort_name)
+
+    report = {"k": k, "queries": len(judgments), "index": VECTOR_INDEX_TYPE, "search": rows, "chunk_sizes": chunk_rows}
+    if output:
+        try:
+            with open(os.path.expanduser(output), "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(colorize_output(f"Report written to {output}", "yellow"))
+        except OSError as e:
+            print(f"Error writing report: {e}")
+    return report
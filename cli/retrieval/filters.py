@@ -0,0 +1,82 @@
+import fnmatch
+import os
+from typing import List, Tuple
+from psycopg2 import sql
+import psycopg2.extras
+from utils.paths import normalize_path
+
+# Filter keys accepted as key:value tokens, e.g. "search source:~/notes/* type:pdf after:2024-06-01 nmap"
+FILTER_KEYS = ("source", "dir", "type", "after", "before")
+
+def parse_filters(text: str) -> Tuple[str, List[Tuple[str, str]]]:
+    # Splits known key:value tokens off the text; everything else stays part of the query
+    filters = []
+    words = []
+    for token in text.split():
+        key, sep, value = token.partition(":")
+        if sep and value and key.lower() in FILTER_KEYS:
+            filters.append((key.lower(), value))
+        else:
+            words.append(token)
+    return " ".join(words), filters
+
+def glob_to_like(pattern: str) -> str:
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+def source_pattern(pattern: str) -> str:
+    # Stored sources are normalized paths, so normalize the pattern's directories up to the first wildcard.
+    # A pattern starting with a wildcard, like *.md, matches anywhere and is left alone.
+    parts = pattern.split(os.sep)
+    wildcard = next((i for i, part in enumerate(parts) if "*" in part or "?" in part), None)
+    if wildcard is None:
+        return normalize_path(pattern)
+    if wildcard == 0:
+        return pattern
+    return os.path.join(normalize_path(os.sep.join(parts[:wildcard]) or os.sep), *parts[wildcard:])
+
+def compile_filters(filters: List[Tuple[str, str]]):
+    # Each predicate is written against an indexed expression (see migration 7) so it combines
+    # with the vector ORDER BY instead of post-filtering the top-k by hand.
+    predicates = []
+    params = {}
+    for i, (key, value) in enumerate(filters or []):
+        name = f"filter_{i}"
+        if key == "source":
+            params[name] = glob_to_like(source_pattern(value))
+            predicates.append(sql.SQL("(metadata->>'source') LIKE {}").format(sql.Placeholder(name)))
+        elif key == "dir":
+            params[name] = glob_to_like(os.path.join(normalize_path(value), "")) + "%"
+            predicates.append(sql.SQL("(metadata->>'source') LIKE {}").format(sql.Placeholder(name)))
+        elif key == "type":
+            params[name] = psycopg2.extras.Json({"type": value.lower().lstrip(".")})
+            predicates.append(sql.SQL("metadata @> {}").format(sql.Placeholder(name)))
+        elif key == "after":
+            params[name] = value
+            predicates.append(sql.SQL("(metadata->>'ingested_at') >= {}").format(sql.Placeholder(name)))
+        elif key == "before":
+            params[name] = value
+            predicates.append(sql.SQL("(metadata->>'ingested_at') < {}").format(sql.Placeholder(name)))
+    if not predicates:
+        return sql.SQL("TRUE"), params
+    return sql.SQL(" AND ").join(predicates), params
+
+def matches_filters(metadata: dict, filters: List[Tuple[str, str]]) -> bool:
+    # The same predicates as compile_filters, for stores that filter in Python
+    source = metadata.get("source") or ""
+    ingested_at = metadata.get("ingested_at") or ""
+    for key, value in filters or []:
+        if key == "source" and not fnmatch.fnmatchcase(source, source_pattern(value)):
+            return False
+        if key == "dir" and not fnmatch.fnmatchcase(source, os.path.join(normalize_path(value), "") + "*"):
+            return False
+        if key == "type" and metadata.get("type") != value.lower().lstrip("."):
+            return False
+        if key == "after" and not ingested_at >= value:
+            return False
+        if key == "before" and not ingested_at < value:
+            return False
+    return True
+
+def describe_filters(filters: List[Tuple[str, str]]) -> str:
+    return " ".join(f"{key}:{value}" for key, value in filters)
@@ -0,0 +1,78 @@
+import json
+import time
+import psycopg2
+from psycopg2 import sql
+from config import EMBEDDING_STORAGE, RESCORE_FACTOR
+from database.connection import connect_db, release_db
+from database.migrations import get_embedding_state
+from retrieval.filters import compile_filters
+from retrieval.similarity import nearest_documents
+from utils.output import colorize_output
+
+STORAGE_MODES = ("full", "halfvec", "binary")
+
+def bytes_per_vector(storage: str, dims: int) -> int:
+    # Payload plus pgvector's 8-byte header; index tuple overhead comes on top
+    if storage == "halfvec":
+        return 2 * dims + 8
+    if storage == "binary":
+        return (dims + 7) // 8 + 8
+    return 4 * dims + 8
+
+def sample_embeddings(cur, samples: int):
+    cur.execute("SELECT embedding::text FROM documents WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s", (samples,))
+    return [json.loads(row[0]) for row in cur.fetchall()]
+
+def nearest_ids(cur, storage: str, embedding, k: int):
+    cur.execute(
+        sql.SQL("SELECT id FROM ({nearest}) nearest ORDER BY distance").format(
+            nearest=nearest_documents(compile_filters([])[0], len(embedding), sql.Placeholder("limit"), storage=storage)
+        ),
+        {"embedding": embedding, "limit": k, "rescore": k if storage == "full" else k * RESCORE_FACTOR}
+    )
+    return [row[0] for row in cur.fetchall()]
+
+def compare_storage_modes(samples: int = 20, k: int = 10):
+    # Measures recall@k of each storage mode's candidate ordering plus rescoring against exact float32 search,
+    # using stored chunks as queries. Index scans are disabled so the numbers isolate quantization loss
+    # from ANN approximation; only the configured mode has an index to report the size of.
+    conn = connect_db()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            _, dims, _, _ = get_embedding_state(cur)
+            cur.execute("""
+                SELECT pg_total_relation_size('documents'),
+                       COALESCE(pg_relation_size(to_regclass('documents_embedding_idx')), 0),
+                       (SELECT COUNT(*) FROM documents)
+            """)
+            table_size, index_size, rows = cur.fetchone()
+            queries = sample_embeddings(cur, samples)
+            if not queries:
+                print(colorize_output("No documents stored yet.", "yellow"))
+                return
+            cur.execute("SET LOCAL enable_indexscan = off")
+            exact = [set(nearest_ids(cur, "full", embedding, k)) for embedding in queries]
+
+            print(colorize_output(f"{rows} chunks of {dims} dimensions, table {table_size / 1024 ** 2:.1f} MB, "
+                                  f"{EMBEDDING_STORAGE} index {index_size / 1024 ** 2:.1f} MB.", "yellow"))
+            for storage in STORAGE_MODES:
+                found = 0
+                start = time.perf_counter()
+                for embedding, truth in zip(queries, exact):
+                    found += len(truth.intersection(nearest_ids(cur, storage, embedding, k)))
+                elapsed = (time.perf_counter() - start) / len(queries)
+                recall = found / sum(len(truth) for truth in exact)
+                estimate = bytes_per_vector(storage, dims) * rows / 1024 ** 2
+                marker = " (configured)" if storage == EMBEDDING_STORAGE else ""
+                print(colorize_output(
+                    f"- {storage}{marker}: {bytes_per_vector(storage, dims)} B/vector (~{estimate:.1f} MB), "
+                    f"recall@{k} {recall:.3f}, {elapsed * 1000:.1f} ms/query without index", "white"
+                ))
+        conn.rollback()
+    except psycopg2.Error as e:
+        print(f"Error comparing storage modes: {e}")
+        conn.rollback()
+    finally:
+        release_db(conn)
@@ -1,37 +1,161 @@
+import asyncio
+import threading
 from typing import List, Tuple
 from psycopg2 import sql
-from database.connection import connect_db
-from embedding.embed import get_embedding
+from config import (
+    RERANK_MODEL, RERANK_BATCH_SIZE, QUERY_CACHE_PERSIST,
+    STORAGE_BACKEND, HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K, TEXT_SEARCH_CONFIG, EMBEDDING_STORAGE, RESCORE_FACTOR
+)
+from database.connection import connect_db, release_db, configure_vector_search
+from database.migrations import get_embedding_state
+from embedding.embed import get_embedding, get_embedding_async
+from embedding.cache import get_embeddings_cached
+from retrieval.cache import query_embeddings, search_results, corpus_version
+from retrieval.filters import compile_filters, parse_filters, describe_filters
+from storage.store import get_store
 from utils.output import colorize_output
-from sentence_transformers import CrossEncoder
+from utils.tracing import traced, annotate
 
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    # Loaded once per process on first use; importing sentence_transformers alone takes seconds
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            from sentence_transformers import CrossEncoder
+            _reranker = CrossEncoder(RERANK_MODEL)
+        return _reranker
+
+@traced("rerank")
 def rerank_documents(query: str, documents: List[Tuple[str, float]], top_k: int = 3) -> List[Tuple[str, float]]:
-    cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-    pairs = [(query, doc[0]) for doc in documents]
-    scores = cross_encoder.predict(pairs)
-    reranked = list(zip([doc[0] for doc in documents], scores))
+    # Identical chunks retrieved by several queries are scored once, all in a single predict call
+    contents = list(dict.fromkeys(doc[0] for doc in documents))
+    annotate(candidates=len(contents))
+    if not contents:
+        return []
+    scores = get_reranker().predict([(query, content) for content in contents], batch_size=RERANK_BATCH_SIZE)
+    reranked = list(zip(contents, (float(score) for score in scores)))
     return sorted(reranked, key=lambda x: x[1], reverse=True)[:top_k]
 
-def retrieve_similar_documents(query: str, limit: int = 10) -> List[Tuple[str, float]]:
-    conn = connect_db()
-    if not conn:
-        return []
+def rescore_limit(limit: int) -> int:
+    return limit if EMBEDDING_STORAGE == "full" else limit * RESCORE_FACTOR
+
+def nearest_documents(where, dims: int, limit, storage: str = EMBEDDING_STORAGE):
+    # Subquery yielding (id, content, distance) of the nearest rows by full-precision cosine distance.
+    # The inner ORDER BY uses the raw operator on the indexed expression so the ANN index serves the scan;
+    # compact storage orders by the quantized expression, then rescores %(rescore)s candidates exactly.
+    if storage == "full":
+        return sql.SQL("""
+            SELECT id, content, embedding <=> %(embedding)s::vector AS distance
+            FROM documents
+            WHERE {where}
+            ORDER BY embedding <=> %(embedding)s::vector
+            LIMIT {limit}
+        """).format(where=where, limit=limit)
+    if storage == "halfvec":
+        order = sql.SQL("embedding::halfvec({dims}) <=> %(embedding)s::halfvec({dims})")
+    else:
+        order = sql.SQL("binary_quantize(embedding)::bit({dims}) <~> binary_quantize(%(embedding)s::vector)")
+    return sql.SQL("""
+        SELECT id, content, distance FROM (
+            SELECT id, content, embedding <=> %(embedding)s::vector AS distance
+            FROM documents
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT %(rescore)s
+        ) candidates
+        ORDER BY distance
+        LIMIT {limit}
+    """).format(where=where, order=order.format(dims=sql.Literal(int(dims))), limit=limit)
+
+@traced("vector_search")
+def vector_search(cur, query_embedding: List[float], limit: int, filters=None, effort: int = None) -> List[Tuple[str, float]]:
+    where, params = compile_filters(filters)
+    configure_vector_search(cur, rescore_limit(limit), filtered=bool(filters), effort=effort)
+    cur.execute(
+        sql.SQL("SELECT content, 1 - distance AS similarity FROM ({nearest}) nearest ORDER BY distance").format(
+            nearest=nearest_documents(where, len(query_embedding), sql.Placeholder("limit"))
+        ),
+        {"embedding": query_embedding, "limit": limit, "rescore": rescore_limit(limit), **params}
+    )
+    results = cur.fetchall()
+    annotate(results=len(results))
+    return results
+
+@traced("hybrid_search")
+def hybrid_search(cur, query: str, query_embedding: List[float], limit: int,
+                  candidates: int = HYBRID_CANDIDATES, filters=None, effort: int = None) -> List[Tuple[str, float]]:
+    # Fuse the top vector hits and the top full-text hits with reciprocal rank fusion
+    candidates = max(candidates, limit)
+    where, params = compile_filters(filters)
+    configure_vector_search(cur, rescore_limit(candidates), filtered=bool(filters), effort=effort)
+    cur.execute(
+        sql.SQL("""
+            WITH semantic AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM ({nearest}) nearest
+            ),
+            lexical AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT id, ts_rank_cd(content_tsv, query) AS score
+                    FROM documents, websearch_to_tsquery({config}, %(query)s) query
+                    WHERE content_tsv @@ query AND {where}
+                    ORDER BY score DESC
+                    LIMIT %(candidates)s
+                ) matches
+            )
+            SELECT documents.content,
+                   COALESCE(1.0 / (%(rrf_k)s + semantic.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + lexical.rank), 0) AS score
+            FROM semantic
+            FULL OUTER JOIN lexical ON semantic.id = lexical.id
+            JOIN documents ON documents.id = COALESCE(semantic.id, lexical.id)
+            ORDER BY score DESC
+            LIMIT %(limit)s
+        """).format(
+            config=sql.Literal(TEXT_SEARCH_CONFIG), where=where,
+            nearest=nearest_documents(where, len(query_embedding), sql.Placeholder("candidates"))
+        ),
+        {
+            "embedding": query_embedding, "query": query, "candidates": candidates,
+            "rescore": rescore_limit(candidates), "rrf_k": RRF_K, "limit": limit, **params
+        }
+    )
+    results = [(content, float(score)) for content, score in cur.fetchall()]
+    annotate(candidates=candidates, results=len(results))
+    return results
+
+def cached_vector_search(cur, query: str, query_embedding: List[float], model: str, limit: int,
+                         filters=None) -> List[Tuple[str, float]]:
+    key = (model, tuple(query_embedding), query if HYBRID_SEARCH else None, tuple(filters or ()), limit, corpus_version())
+    results = search_results.get(key)
+    if results is None:
+        if HYBRID_SEARCH:
+            results = hybrid_search(cur, query, query_embedding, limit, filters=filters)
+        else:
+            results = vector_search(cur, query_embedding, limit, filters=filters)
+        search_results.put(key, results)
+    return list(results)
+
+def retrieve_similar_documents(query: str, limit: int = 10, rerank: bool = True, filters=None) -> List[Tuple[str, float]]:
+    store = get_store()
     try:
-        query_embedding = get_embedding(query)
-        if not query_embedding:
+        model = store.embedding_model()
+        if not model:
             return []
+        query_embedding = query_embeddings.get((model, query))
+        if query_embedding is None:
+            query_embedding = (store.embed_queries([query], model) if QUERY_CACHE_PERSIST else [get_embedding(query, model=model)])[0]
+            if not query_embedding:
+                return []
+            query_embeddings.put((model, query), query_embedding)
         
-        with conn.cursor() as cur:
-            cur.execute(
-                sql.SQL("""
-                    SELECT content, 1 - (embedding <=> %s::vector) AS similarity
-                    FROM documents
-                    ORDER BY similarity DESC
-                    LIMIT %s
-                """),
-                (query_embedding, limit)
-            )
-            initial_results = cur.fetchall()
+        initial_results = store.search(query, query_embedding, model, limit, filters)
+        
+        if not rerank:
+            return initial_results
         
         # Rerank the results
         reranked_results = rerank_documents(query, initial_results, top_k=3)
@@ -40,14 +164,100 @@ def retrieve_similar_documents(query: str, limit: int = 10) -> List[Tuple[str, f
     except Exception as e:
         print(f"Error retrieving similar documents: {e}")
         return []
+
+def active_embedding_model() -> str:
+    conn = connect_db()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            model, _, _, _ = get_embedding_state(cur)
+        return model
+    except Exception as e:
+        print(f"Error reading embedding state: {e}")
+        return None
+    finally:
+        release_db(conn)
+
+def search_by_embedding(query: str, query_embedding: List[float], model: str, limit: int = 10,
+                        filters=None) -> List[Tuple[str, float]]:
+    conn = connect_db()
+    if not conn:
+        return []
+    try:
+        with conn.cursor() as cur:
+            # The swap holds documents ACCESS EXCLUSIVE while it changes embedding_state, so once this
+            # (non-blocking between readers) lock is held the state read below matches the column layout
+            cur.execute("LOCK TABLE documents IN ACCESS SHARE MODE")
+            live_model, _, _, _ = get_embedding_state(cur)
+            if live_model != model:
+                # The embedding column was swapped after the batch was embedded
+                query_embedding = get_embedding(query, model=live_model)
+            if not query_embedding:
+                return []
+            results = cached_vector_search(cur, query, query_embedding, live_model, limit, filters=filters)
+        conn.commit()
+        return results
+    except Exception as e:
+        print(f"Error retrieving similar documents: {e}")
+        return []
+    finally:
+        release_db(conn)
+
+def embed_queries_persistent(queries: List[str], model: str) -> List[List[float]]:
+    conn = connect_db()
+    if not conn:
+        return get_embedding(queries, model=model)
+    try:
+        with conn.cursor() as cur:
+            embeddings = get_embeddings_cached(cur, queries, model)
+        conn.commit()
+        return embeddings
+    except Exception as e:
+        print(f"Error reading embedding cache: {e}")
+        conn.rollback()
+        return get_embedding(queries, model=model)
     finally:
-        conn.close()
+        release_db(conn)
+
+@traced("embed_queries")
+async def embed_queries(queries: List[str], model: str) -> List[List[float]]:
+    # In-process LRU first, then the persistent embedding cache or Ollama for the misses in one batch
+    embeddings = [query_embeddings.get((model, query)) for query in queries]
+    misses = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+    annotate(queries=len(queries), cache_misses=len(misses))
+    if misses:
+        if QUERY_CACHE_PERSIST:
+            fresh = await asyncio.to_thread(get_store().embed_queries, misses, model)
+        else:
+            fresh = await get_embedding_async(misses, model=model)
+        fresh = dict(zip(misses, fresh))
+        for query, embedding in fresh.items():
+            if embedding:
+                query_embeddings.put((model, query), embedding)
+        embeddings = [embedding if embedding is not None else fresh.get(query, []) for query, embedding in zip(queries, embeddings)]
+    return embeddings
+
+async def retrieve_similar_documents_async(queries: List[str], limit: int = 10, filters=None) -> List[List[Tuple[str, float]]]:
+    # One batched embedding call for all queries, then the searches run concurrently
+    store = get_store()
+    model = await asyncio.to_thread(store.embedding_model)
+    if not model or not queries:
+        return [[] for _ in queries]
+    embeddings = await embed_queries(queries, model)
+    return await asyncio.gather(*(
+        asyncio.to_thread(store.search, query, embedding, model, limit, filters)
+        for query, embedding in zip(queries, embeddings)
+    ))
 
-def search_documents(query: str):
-    similar_docs = retrieve_similar_documents(query)
-    print(colorize_output("\nRelevant documents:", "yellow"))
+def search_documents(query: str, filters=None):
+    # Inline key:value tokens (source:, dir:, type:, after:, before:) narrow the search
+    query, inline_filters = parse_filters(query)
+    filters = list(filters or []) + inline_filters
+    similar_docs = retrieve_similar_documents(query, filters=filters)
+    print(colorize_output("\nRelevant documents" + (f" ({describe_filters(filters)}):" if filters else ":"), "yellow"))
     for doc, similarity in similar_docs:
-        print(colorize_output(f"Similarity: {similarity:.2f}", "white"))
+        print(colorize_output(f"{'Score' if HYBRID_SEARCH and STORAGE_BACKEND == 'postgres' else 'Similarity'}: {similarity:.2f}", "white"))
         print(doc[:200] + "..." if len(doc) > 200 else doc)
         print()
     return similar_docs  # Return the results for further processing
\ No newline at end of file
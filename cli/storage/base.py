@@ -0,0 +1,67 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+class VectorStore(ABC):
+    # What ingestion and retrieval need from storage. Chunks are (content, metadata) pairs and
+    # search returns (content, score) pairs, best first.
+
+    @abstractmethod
+    def initialize(self):
+        pass
+
+    def start_reembedding(self):
+        # Re-embed in the background when the configured embedding model changed; returns the thread
+        return None
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def is_file_in_database(self, file_path: str) -> bool:
+        pass
+
+    @abstractmethod
+    def get_source_catalog(self, directory_path: str) -> Dict[str, Tuple[int, float, str]]:
+        # path -> (size, mtime, content_hash) for every known file under the directory
+        pass
+
+    @abstractmethod
+    def touch_source(self, file_path: str, size: int, mtime: float):
+        pass
+
+    @abstractmethod
+    def embed_source_chunks(self, chunks: List[Tuple[str, dict]]) -> Tuple[Optional[str], List[List[float]]]:
+        # Returns the model used alongside the embeddings; a failed chunk gets an empty embedding
+        pass
+
+    @abstractmethod
+    def write_sources(self, items: List[tuple]) -> Dict[str, int]:
+        # Each item is (file_path, chunks, model, embeddings, size, mtime, content_hash); returns stored chunk counts
+        pass
+
+    def replace_source(self, file_path: str, chunks: List[Tuple[str, dict]], size: int, mtime: float,
+                       content_hash: str) -> int:
+        model, embeddings = self.embed_source_chunks(chunks)
+        return self.write_sources([(file_path, chunks, model, embeddings, size, mtime, content_hash)]).get(file_path, 0)
+
+    @abstractmethod
+    def forget_document(self, file_path: str):
+        pass
+
+    @abstractmethod
+    def list_documents(self):
+        pass
+
+    @abstractmethod
+    def embedding_model(self) -> Optional[str]:
+        # The model whose embeddings searches are currently served from
+        pass
+
+    @abstractmethod
+    def embed_queries(self, queries: List[str], model: str) -> List[List[float]]:
+        pass
+
+    @abstractmethod
+    def search(self, query: str, query_embedding: List[float], model: str, limit: int,
+               filters=None) -> List[Tuple[str, float]]:
+        pass
@@ -0,0 +1,323 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import (
+    LOCAL_STORE_PATH, LOCAL_COMPACT_RATIO, EMBEDDING_MODEL, EMBEDDING_SIZE, EMBEDDING_BATCH_SIZE
+)
+from embedding.embed import get_embedding
+from retrieval.cache import bump_corpus_version
+from retrieval.filters import matches_filters
+from storage.base import VectorStore
+from utils.output import colorize_output
+from utils.tracing import traced, annotate
+
+# Files in LOCAL_STORE_PATH:
+#   state.json               model, size and the current generation
+#   embeddings-<gen>.f32     float32 matrix of L2-normalised rows, memory-mapped and grown by doubling
+#   chunks-<gen>.jsonl       append-only log of chunk, delete, source and forget records, replayed on open
+# A row is only live once its log record is on disk, so an interrupted write leaves the store as it was.
+# Compaction and re-embedding write the next generation beside the current one and switch state.json to it.
+
+INITIAL_ROWS = 1024
+MIN_COMPACT_ROWS = 1024
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def open_matrix(path: str, dims: int, rows: int = 0) -> np.memmap:
+    with open(path, "ab"):
+        pass
+    capacity = os.path.getsize(path) // (4 * dims)
+    if capacity < max(rows, 1):
+        capacity = max(rows, INITIAL_ROWS, capacity * 2)
+        os.truncate(path, capacity * dims * 4)
+    return np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, dims))
+
+class LocalStore(VectorStore):
+    def __init__(self, directory: str = LOCAL_STORE_PATH):
+        self.directory = os.path.expanduser(directory)
+        self.lock = threading.RLock()
+        self.log = None
+        self.reembedding = False
+
+    def paths(self, generation: int) -> Tuple[str, str]:
+        return (
+            os.path.join(self.directory, f"embeddings-{generation}.f32"),
+            os.path.join(self.directory, f"chunks-{generation}.jsonl")
+        )
+
+    def write_state(self, model: str, size: int, generation: int):
+        path = os.path.join(self.directory, "state.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"model": model, "size": size, "generation": generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def load(self):
+        state_path = os.path.join(self.directory, "state.json")
+        if not os.path.exists(state_path):
+            self.write_state(EMBEDDING_MODEL, EMBEDDING_SIZE, 0)
+        with open(state_path) as f:
+            state = json.load(f)
+        self.model, self.dims, self.generation = state["model"], state["size"], state["generation"]
+
+        matrix_path, log_path = self.paths(self.generation)
+        self.matrix = open_matrix(matrix_path, self.dims)
+        self.alive = np.zeros(len(self.matrix), dtype=bool)
+        self.contents = []
+        self.metadata = []
+        self.source_rows = {}
+        self.sources = {}
+        self.dead = 0
+
+        # Replay up to the last complete record and drop a torn tail
+        offset = 0
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    offset += len(line)
+                    self.apply(record)
+            if os.path.getsize(log_path) > offset:
+                os.truncate(log_path, offset)
+        if self.log is not None:
+            self.log.close()
+        self.log = open(log_path, "a", encoding="utf-8")
+
+    def apply(self, record: dict):
+        op = record["op"]
+        if op == "chunk":
+            row = len(self.contents)
+            self.contents.append(record["content"])
+            self.metadata.append(record["metadata"])
+            self.alive[row] = True
+            self.source_rows.setdefault(record["metadata"].get("source"), []).append(row)
+        elif op == "delete" or op == "forget":
+            rows = self.source_rows.pop(record["path"], [])
+            self.alive[rows] = False
+            self.dead += len(rows)
+            if op == "forget":
+                self.sources.pop(record["path"], None)
+        elif op == "source":
+            self.sources[record["path"]] = {key: record[key] for key in ("size", "mtime", "content_hash", "chunk_count", "ingested_at")}
+
+    @property
+    def count(self) -> int:
+        return len(self.contents)
+
+    def append(self, records: List[dict], vectors: List[List[float]]):
+        # Rows first, then the log records that make them live; chunk records match vectors in order
+        if vectors:
+            start, end = self.count, self.count + len(vectors)
+            if end > len(self.matrix):
+                self.matrix.flush()
+                self.matrix = open_matrix(self.paths(self.generation)[0], self.dims, end)
+                alive = np.zeros(len(self.matrix), dtype=bool)
+                alive[:len(self.alive)] = self.alive
+                self.alive = alive
+            self.matrix[start:end] = normalize(vectors)
+            self.matrix.flush()
+        self.log.write("".join(json.dumps(record) + "\n" for record in records))
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        for record in records:
+            self.apply(record)
+
+    def rewrite(self, model: str, dims: int, vectors: Optional[np.ndarray] = None):
+        # Write the live rows (optionally with new embeddings, in row order) as the next generation
+        rows = np.flatnonzero(self.alive[:self.count])
+        generation = self.generation + 1
+        matrix_path, log_path = self.paths(generation)
+        for path in (matrix_path, log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        matrix = open_matrix(matrix_path, dims, len(rows))
+        if len(rows):
+            matrix[:len(rows)] = self.matrix[rows] if vectors is None else vectors
+        matrix.flush()
+        del matrix
+        with open(log_path, "w", encoding="utf-8") as log:
+            for row in rows:
+                log.write(json.dumps({"op": "chunk", "content": self.contents[row], "metadata": self.metadata[row]}) + "\n")
+            for path, source in self.sources.items():
+                log.write(json.dumps({"op": "source", "path": path, **source}) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        old = self.paths(self.generation)
+        self.write_state(model, dims, generation)
+        self.load()
+        for path in old:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def maybe_compact(self):
+        if not self.reembedding and self.dead >= MIN_COMPACT_ROWS and self.dead > self.count * LOCAL_COMPACT_RATIO:
+            self.rewrite(self.model, self.dims)
+
+    def embed_texts(self, texts: List[str], model: str) -> List[List[float]]:
+        # A batch that fails to embed is reported and left empty so callers skip it
+        embeddings = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            batch_embeddings = get_embedding(batch, model=model)
+            if len(batch_embeddings) != len(batch) or not all(batch_embeddings):
+                print(f"Error embedding batch {start // EMBEDDING_BATCH_SIZE} (chunks {start}-{start + len(batch) - 1}), skipping.")
+                batch_embeddings = [[] for _ in batch]
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def initialize(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self.load()
+            print(f"Local store ready: {self.count - self.dead} chunks from {len(self.sources)} documents in {self.directory}.")
+
+    def start_reembedding(self):
+        if (self.model, self.dims) == (EMBEDDING_MODEL, EMBEDDING_SIZE):
+            return None
+        print(colorize_output(f"Embedding model changed from {self.model} ({self.dims} dims) to {EMBEDDING_MODEL} ({EMBEDDING_SIZE} dims).", "yellow"))
+        print(colorize_output("Re-embedding documents in the background; searches use the previous embeddings until it completes.", "yellow"))
+        self.reembedding = True
+        thread = threading.Thread(target=self.reembed, args=(EMBEDDING_MODEL, EMBEDDING_SIZE), name="reembed", daemon=True)
+        thread.start()
+        return thread
+
+    def reembed(self, model: str, dims: int):
+        try:
+            with self.lock:
+                rows = np.flatnonzero(self.alive[:self.count])
+                texts = [self.contents[row] for row in rows]
+            embedded = dict(zip(rows.tolist(), self.embed_texts(texts, model)))
+            with self.lock:
+                # Catch up on files written while the rest was embedding, then switch generations
+                live = np.flatnonzero(self.alive[:self.count]).tolist()
+                missing = [row for row in live if row not in embedded]
+                embedded.update(zip(missing, self.embed_texts([self.contents[row] for row in missing], model)))
+                vectors = [embedded[row] for row in live]
+                if not all(len(vector) == dims for vector in vectors):
+                    raise RuntimeError(f"{sum(len(vector) != dims for vector in vectors)} chunks failed to embed")
+                self.rewrite(model, dims, normalize(vectors) if vectors else None)
+            bump_corpus_version()
+            print(colorize_output(f"Switched searches to {model} embeddings.", "yellow"))
+        except (OSError, RuntimeError) as e:
+            print(f"Re-embedding interrupted, it will restart on next start: {e}")
+        finally:
+            self.reembedding = False
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def is_file_in_database(self, file_path: str) -> bool:
+        return self.sources.get(file_path, {}).get("chunk_count", 0) > 0
+
+    def get_source_catalog(self, directory_path: str) -> Dict[str, Tuple[int, float, str]]:
+        prefix = os.path.join(directory_path, "")
+        with self.lock:
+            return {
+                path: (source["size"], source["mtime"], source["content_hash"])
+                for path, source in self.sources.items() if path.startswith(prefix)
+            }
+
+    def touch_source(self, file_path: str, size: int, mtime: float):
+        with self.lock:
+            source = self.sources.get(file_path)
+            if source is not None:
+                self.append([{"op": "source", "path": file_path, **source, "size": size, "mtime": mtime}], [])
+
+    def embed_source_chunks(self, chunks: List[Tuple[str, dict]]) -> Tuple[Optional[str], List[List[float]]]:
+        model = self.model
+        return model, self.embed_texts([content for content, _ in chunks], model)
+
+    def write_sources(self, items: List[tuple]) -> Dict[str, int]:
+        results = {}
+        try:
+            with self.lock:
+                for file_path, chunks, model, embeddings, size, mtime, content_hash in items:
+                    if model != self.model:
+                        # The store was re-embedded while this file was in flight
+                        _, embeddings = self.embed_source_chunks(chunks)
+                    stored = [(chunk, embedding) for chunk, embedding in zip(chunks, embeddings) if len(embedding) == self.dims]
+                    records = [{"op": "delete", "path": file_path}]
+                    records += [{"op": "chunk", "content": content, "metadata": metadata} for (content, metadata), _ in stored]
+                    records.append({
+                        "op": "source", "path": file_path, "size": size, "mtime": mtime,
+                        "content_hash": content_hash if len(stored) == len(chunks) else None,
+                        "chunk_count": len(stored), "ingested_at": datetime.now().isoformat(timespec="seconds")
+                    })
+                    self.append(records, [embedding for _, embedding in stored])
+                    results[file_path] = len(stored)
+                self.maybe_compact()
+        except OSError as e:
+            print(f"Error writing {len(items)} documents: {e}")
+        bump_corpus_version()
+        return results
+
+    def forget_document(self, file_path: str):
+        try:
+            with self.lock:
+                self.append([{"op": "forget", "path": file_path}], [])
+                self.maybe_compact()
+            bump_corpus_version()
+            print(colorize_output(f"Document '{file_path}' has been removed from the database.", "yellow"))
+        except OSError as e:
+            print(f"Error removing document: {e}")
+
+    def list_documents(self):
+        with self.lock:
+            documents = sorted(self.sources.items())
+        print(colorize_output("Stored documents:", "yellow"))
+        for path, source in documents:
+            size_text = f", {source['size'] / 1024:.1f} KB" if source["size"] is not None else ""
+            ingested_at = datetime.fromisoformat(source["ingested_at"])
+            print(colorize_output(f"- {path} ({source['chunk_count']} chunks{size_text}, ingested {ingested_at:%Y-%m-%d %H:%M})", "white"))
+        print(colorize_output(f"{len(documents)} documents, {sum(source['chunk_count'] for _, source in documents)} chunks.", "yellow"))
+
+    def embedding_model(self) -> Optional[str]:
+        return self.model
+
+    def embed_queries(self, queries: List[str], model: str) -> List[List[float]]:
+        return get_embedding(queries, model=model)
+
+    @traced("local_search")
+    def search(self, query: str, query_embedding: List[float], model: str, limit: int,
+               filters=None) -> List[Tuple[str, float]]:
+        # Snapshot under the lock; appends only add rows past count and rewrites swap in new objects
+        with self.lock:
+            live_model, dims, count = self.model, self.dims, self.count
+            matrix, contents, metadata = self.matrix, self.contents, self.metadata
+            alive = self.alive[:count].copy()
+        if live_model != model:
+            # The store was re-embedded after the query was embedded
+            query_embedding = get_embedding(query, model=live_model)
+        if len(query_embedding) != dims:
+            return []
+        if filters:
+            alive &= np.fromiter((matches_filters(metadata[row], filters) for row in range(count)), dtype=bool, count=count)
+        rows = np.flatnonzero(alive)
+        if not len(rows) or limit <= 0:
+            return []
+
+        query_vector = normalize([query_embedding])[0]
+        scores = (matrix[:count] @ query_vector)[rows] if len(rows) > count // 2 else matrix[rows] @ query_vector
+        k = min(limit, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        annotate(scanned=len(rows), results=k)
+        return [(contents[rows[i]], float(scores[i])) for i in top]
@@ -0,0 +1,53 @@
+from typing import Dict, List, Optional, Tuple
+from database.connection import initialize_db, close_pool
+from database import operations
+from retrieval import similarity
+from storage.base import VectorStore
+
+class PostgresStore(VectorStore):
+    # pgvector storage; the implementation lives in database/operations.py and retrieval/similarity.py
+
+    def initialize(self):
+        initialize_db()
+
+    def start_reembedding(self):
+        return operations.start_reembedding()
+
+    def close(self):
+        close_pool()
+
+    def is_file_in_database(self, file_path: str) -> bool:
+        return operations.is_file_in_database(file_path)
+
+    def get_source_catalog(self, directory_path: str) -> Dict[str, Tuple[int, float, str]]:
+        return operations.get_source_catalog(directory_path)
+
+    def touch_source(self, file_path: str, size: int, mtime: float):
+        operations.touch_source(file_path, size, mtime)
+
+    def embed_source_chunks(self, chunks: List[Tuple[str, dict]]) -> Tuple[Optional[str], List[List[float]]]:
+        return operations.embed_source_chunks(chunks)
+
+    def write_sources(self, items: List[tuple]) -> Dict[str, int]:
+        return operations.write_sources(items)
+
+    def replace_source(self, file_path: str, chunks: List[Tuple[str, dict]], size: int, mtime: float,
+                       content_hash: str) -> int:
+        # Embeds inside the replacing transaction rather than ahead of it
+        return operations.replace_source(file_path, chunks, size, mtime, content_hash)
+
+    def forget_document(self, file_path: str):
+        operations.forget_document(file_path)
+
+    def list_documents(self):
+        operations.list_documents()
+
+    def embedding_model(self) -> Optional[str]:
+        return similarity.active_embedding_model()
+
+    def embed_queries(self, queries: List[str], model: str) -> List[List[float]]:
+        return similarity.embed_queries_persistent(queries, model)
+
+    def search(self, query: str, query_embedding: List[float], model: str, limit: int,
+               filters=None) -> List[Tuple[str, float]]:
+        return similarity.search_by_embedding(query, query_embedding, model, limit, filters)
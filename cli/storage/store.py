@@ -0,0 +1,21 @@
+import threading
+from config import STORAGE_BACKEND
+from storage.base import VectorStore
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> VectorStore:
+    # The configured backend, created once per process; backends are imported on first use
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORAGE_BACKEND == "postgres":
+                from storage.postgres import PostgresStore
+                _store = PostgresStore()
+            elif STORAGE_BACKEND == "local":
+                from storage.local import LocalStore
+                _store = LocalStore()
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', expected 'postgres' or 'local'")
+        return _store
@@ -0,0 +1,5 @@
+import os
+
+def normalize_path(path: str) -> str:
+    # One spelling per file, so 'notes', './notes' and '~/notes' share catalog entries and chunks
+    return os.path.realpath(os.path.expanduser(os.path.expandvars(path)))
@@ -0,0 +1,19 @@
+import time
+from utils.output import colorize_output
+
+class StartupProfile:
+    # Wall-clock time of each startup stage, measured from the previous mark
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def report(self):
+        print(colorize_output("Startup profile:", "yellow"))
+        for stage, seconds in self.stages:
+            print(colorize_output(f"- {stage}: {seconds * 1000:.0f} ms", "white"))
+        print(colorize_output(f"Ready after {(self.last - self.start) * 1000:.0f} ms; 'python -X importtime main.py' breaks imports down per module.", "yellow"))
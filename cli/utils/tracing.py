@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import TRACE_LOG_PATH, TRACE_PRINT, METRICS_FILE
+from utils.output import colorize_output
+
+# Stages are recorded as spans: a name, a start offset within the current question's trace,
+# a duration and numeric attributes (candidates, results, tokens...). Every span also feeds the
+# process-wide metrics below, whether or not a trace is active. Context variables follow asyncio
+# tasks and asyncio.to_thread, so concurrent searches land in the right trace.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+_metrics_lock = threading.Lock()
+# stage -> (count, total seconds, cumulative bucket counts)
+stage_durations = {}
+# (stage, attribute) -> total
+stage_items = {}
+# name -> last value
+gauges = {}
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {
+            "trace": self.name, "started_at": self.started_at, **self.attributes,
+            "total": time.perf_counter() - self.start, "spans": spans
+        }
+
+def record_span(stage: str, start: float, attributes: dict):
+    # start is a time.perf_counter() reading; the span ends now
+    duration = time.perf_counter() - start
+    with _metrics_lock:
+        count, total, buckets = stage_durations.get(stage, (0, 0.0, [0] * len(DURATION_BUCKETS)))
+        buckets = [n + (duration <= bound) for n, bound in zip(buckets, DURATION_BUCKETS)]
+        stage_durations[stage] = (count + 1, total + duration, buckets)
+        for key, value in attributes.items():
+            # Integer attributes are counts; floats are measurements and only go into the trace
+            if isinstance(value, int) and not isinstance(value, bool):
+                stage_items[(stage, key)] = stage_items.get((stage, key), 0) + value
+    trace = _trace.get()
+    if trace is not None:
+        trace.add({"stage": stage, "start": start - trace.start, "duration": duration, **attributes})
+
+def annotate(**attributes):
+    # Adds attributes to the innermost span of the calling task
+    span = _span.get()
+    if span is not None:
+        span.update(attributes)
+
+def set_gauge(name: str, value: float):
+    with _metrics_lock:
+        gauges[name] = value
+
+@contextmanager
+def span(stage: str, **attributes):
+    token = _span.set(attributes)
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        record_span(stage, start, attributes)
+
+def traced(stage: str):
+    # Records each call of the decorated function or coroutine as a span
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def question_trace(prompt: str):
+    # One trace per question, from recall to the last generated token
+    trace = Trace("question", prompt=prompt)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        finish_trace(trace)
+
+def finish_trace(trace: Trace):
+    data = trace.to_dict()
+    if TRACE_PRINT:
+        stages = {}
+        for span in data["spans"]:
+            stages[span["stage"]] = stages.get(span["stage"], 0) + span["duration"]
+        print(colorize_output(
+            f"Stages ({data['total']:.2f}s): " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()), "yellow"
+        ))
+    try:
+        if TRACE_LOG_PATH:
+            with open(os.path.expanduser(TRACE_LOG_PATH), "a", encoding="utf-8") as f:
+                f.write(json.dumps(data) + "\n")
+        if METRICS_FILE:
+            # Replaced atomically so a node_exporter textfile collector never reads half a file
+            path = os.path.expanduser(METRICS_FILE)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(prometheus_text())
+            os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Error exporting trace: {e}")
+
+def label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text() -> str:
+    with _metrics_lock:
+        durations = dict(stage_durations)
+        items = dict(stage_items)
+        current = dict(gauges)
+    lines = [
+        "# HELP rag_stage_duration_seconds Time spent in each RAG pipeline stage.",
+        "# TYPE rag_stage_duration_seconds histogram",
+    ]
+    for stage, (count, total, buckets) in sorted(durations.items()):
+        for bound, n in zip(DURATION_BUCKETS, buckets):
+            lines.append(f'rag_stage_duration_seconds_bucket{{stage="{label(stage)}",le="{bound}"}} {n}')
+        lines.append(f'rag_stage_duration_seconds_bucket{{stage="{label(stage)}",le="+Inf"}} {count}')
+        lines.append(f'rag_stage_duration_seconds_sum{{stage="{label(stage)}"}} {total}')
+        lines.append(f'rag_stage_duration_seconds_count{{stage="{label(stage)}"}} {count}')
+    lines += [
+        "# HELP rag_stage_items_total Items handled per stage (texts, candidates, results, tokens...).",
+        "# TYPE rag_stage_items_total counter",
+    ]
+    for (stage, item), total in sorted(items.items()):
+        lines.append(f'rag_stage_items_total{{stage="{label(stage)}",item="{label(item)}"}} {total}')
+    for name, value in sorted(current.items()):
+        lines += [f"# TYPE rag_{name} gauge", f"rag_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int):
+    # Serves /metrics on localhost for Prometheus to scrape
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(colorize_output(f"Serving metrics on http://127.0.0.1:{port}/metrics", "yellow"))
+    return server
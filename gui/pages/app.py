@@ -1,12 +1,22 @@
 import streamlit as st
+import altair as alt
+import pandas as pd
 import os
 from utils.assistant import (
-    process_document, forget_document, list_documents, 
-    search_documents, stream_response, recall, DB_PARAMS, EMBEDDING_SIZE
+    process_documents, forget_document, list_documents,
+    search_documents, generate_response, recall, get_pool, DB_PARAMS, DB_POOL_MAX_CONN, EMBEDDING_SIZE,
+    INGEST_WORKERS, QuestionTrace, embedding_broker
 )
 
 st.set_page_config(page_title="Local RAG AI Assistant", layout="wide")
 
+# One connection pool per server process, shared by every session and rerun
+@st.cache_resource
+def db_pool():
+    return get_pool()
+
+db_pool()
+
 logo = os.path.join(os.getcwd(), "media/JC-Profile-Update.png")
 st.image(logo, width=100)
 
@@ -16,18 +26,21 @@ st.header("source.me")
 st.sidebar.header("Document Management")
 
 # File upload
-uploaded_file = st.sidebar.file_uploader("Upload a document", type=["txt", "md", "pdf"])
-if uploaded_file is not None:
-    if st.sidebar.button("Process Document"):
-        with st.spinner("Processing document..."):
-            # Save the file temporarily
-            with open(uploaded_file.name, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            # Process the document
-            process_document(uploaded_file.name)
-            # Remove the temporary file
-            os.remove(uploaded_file.name)
-        st.sidebar.success(f"Document {uploaded_file.name} processed successfully!")
+uploaded_files = st.sidebar.file_uploader("Upload documents", type=["txt", "md", "pdf"], accept_multiple_files=True)
+workers = st.sidebar.number_input("Workers", min_value=1, max_value=DB_POOL_MAX_CONN, value=INGEST_WORKERS)
+if uploaded_files:
+    if st.sidebar.button("Process Documents"):
+        with st.spinner(f"Processing {len(uploaded_files)} documents..."):
+            # Save the files temporarily
+            for uploaded_file in uploaded_files:
+                with open(uploaded_file.name, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+            # Process the documents
+            process_documents([uploaded_file.name for uploaded_file in uploaded_files], workers=int(workers))
+            # Remove the temporary files
+            for uploaded_file in uploaded_files:
+                os.remove(uploaded_file.name)
+        st.sidebar.success(f"Processed {len(uploaded_files)} documents successfully!")
 
 # Document deletion
 doc_to_delete = st.sidebar.text_input("Enter the name of the document to forget:")
@@ -53,6 +66,13 @@ if st.sidebar.button("Search Documents"):
         st.sidebar.write(doc[:200] + "..." if len(doc) > 200 else doc)
         st.sidebar.write("---")
 
+# Embedding broker metrics, shared by every session in this server process
+with st.sidebar.expander("Embedding broker"):
+    stats = embedding_broker.stats()
+    st.write(f"{stats['texts']} texts in {stats['batches']} batches, {stats['pending']} queued")
+    st.write(f"Batch size: mean {stats['mean_batch_size']:.1f}, max {stats['max_batch_size']}")
+    st.write(f"Queue delay: p50 {stats['p50_queue_delay_ms']:.1f} ms, p95 {stats['p95_queue_delay_ms']:.1f} ms")
+
 # Main chat interface
 st.subheader("saveyourdatafromthedatafarms")
 
@@ -72,13 +92,30 @@ if prompt := st.chat_input("What is your question?"):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
 
-    # Generate a response
+    # Retrieve context, then stream the answer into the assistant message as it is generated
+    # One trace per question; module-level state would be shared with every other session
+    trace = QuestionTrace()
     with st.spinner("Thinking..."):
-        context = recall(prompt)
-        response = stream_response(prompt, context)
+        context = recall(prompt, trace)
 
-    # Display assistant response in chat message container
     with st.chat_message("assistant"):
-        st.markdown(response)
+        response = st.write_stream(generate_response(prompt, context, trace))
+        st.caption(" · ".join(f"{stage} {seconds:.2f}s" for stage, seconds in trace.timings.items()))
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
+    st.session_state.last_spans = trace.spans
+
+# Waterfall of the last question's stages, kept per session
+if st.session_state.get("last_spans"):
+    spans = pd.DataFrame(st.session_state.last_spans)
+    spans["end"] = spans["start"] + spans["duration"]
+    with st.sidebar.expander("Last question timeline", expanded=True):
+        st.altair_chart(
+            alt.Chart(spans).mark_bar().encode(
+                x=alt.X("start:Q", title="seconds"),
+                x2="end:Q",
+                y=alt.Y("stage:N", sort=None, title=None),
+                tooltip=[column for column in spans.columns if column != "end"]
+            ),
+            use_container_width=True
+        )
@@ -1,16 +1,22 @@
 import os
 import ast
+import json
+import threading
+import time
 import psycopg2
 import psycopg2.extras
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import ollama
 from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 from tqdm import tqdm
 from colorama import Fore, init
+from concurrent.futures import ThreadPoolExecutor
 import traceback
 import emoji
+from utils.embedding_broker import EmbeddingBroker, INTERACTIVE, BACKGROUND
 
 # Initialize colorama
 init(autoreset=True)
@@ -23,21 +29,86 @@ DB_PARAMS = {
     "host": "localhost",
     "port": "6024"
 }
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = 10
+DB_POOL_TIMEOUT = 30  # Seconds to wait for a pooled connection when all of them are borrowed
 
 # Embedding configuration
 EMBEDDING_MODEL = "nomic-embed-text"
 EMBEDDING_SIZE = 768  # Adjust based on the model's output
+EMBEDDING_MAX_BATCH = 32  # Texts sent to Ollama per request by the embedding broker
+EMBEDDING_MAX_WAIT = 0.01  # Seconds the broker waits for a batch to fill before sending it
 
 # Chat model configuration
 CHAT_MODEL = "llama3"
 
-def connect_db():
+# Relevance filter configuration ("llm" grades all candidates in one chat call, "cross_encoder" scores them locally)
+RELEVANCE_FILTER = "llm"
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RELEVANCE_THRESHOLD = 0.0  # Minimum cross-encoder score for a chunk to be kept
+
+# Ingestion configuration
+INGEST_WORKERS = 4  # Documents processed concurrently from one upload
+
+_pool = None
+_pool_lock = threading.Lock()
+# Notified whenever a connection goes back to the pool
+_released = threading.Condition()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, **DB_PARAMS)
+        return _pool
+
+def is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
     try:
-        return psycopg2.connect(**DB_PARAMS)
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def take_connection(pool, deadline: float):
+    # ThreadedConnectionPool raises PoolError when exhausted instead of waiting, so wait here for a release
+    with _released:
+        while True:
+            try:
+                return pool.getconn()
+            except PoolError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                _released.wait(remaining)
+
+def connect_db(timeout: float = DB_POOL_TIMEOUT):
+    # Borrow a connection from the process-wide pool, replacing it if the server dropped it.
+    # Upload workers and every Streamlit session share DB_POOL_MAX_CONN connections, so wait up to timeout for one.
+    try:
+        pool = get_pool()
+        deadline = time.monotonic() + timeout
+        conn = take_connection(pool, deadline)
+        if not is_healthy(conn):
+            pool.putconn(conn, close=True)
+            conn = take_connection(pool, deadline)
+        return conn
     except psycopg2.Error as e:
         print(f"Unable to connect to the database: {e}")
         return None
 
+def release_db(conn):
+    # Return a borrowed connection to the pool; any open transaction is rolled back
+    try:
+        get_pool().putconn(conn)
+    except psycopg2.Error as e:
+        print(f"Error returning connection to the pool: {e}")
+    with _released:
+        _released.notify()
+
 def initialize_db():
     conn = connect_db()
     if not conn:
@@ -54,12 +125,13 @@ def initialize_db():
                     embedding vector({EMBEDDING_SIZE})
                 )
             """)
+            cur.execute("CREATE INDEX IF NOT EXISTS documents_embedding_idx ON documents USING hnsw (embedding vector_cosine_ops)")
         conn.commit()
         print("Database initialized successfully.")
     except psycopg2.Error as e:
         print(f"Error initializing database: {e}")
     finally:
-        conn.close()
+        release_db(conn)
 
 def update_db_schema():
     conn = connect_db()
@@ -86,39 +158,40 @@ def update_db_schema():
         print(f"Error updating database schema: {e}")
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
 
-def get_embedding(text: str or List[str]) -> List[float] or List[List[float]]:
-    try:
-        if isinstance(text, str):
-            response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=text)
-            return response['embedding']
-        elif isinstance(text, list):
-            response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=text)
-            return [item['embedding'] for item in response['embeddings']]
-        else:
-            raise ValueError("Input must be a string or a list of strings")
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return [] if isinstance(text, str) else [[] for _ in text]
+# One broker per server process, so concurrent sessions and uploads share Ollama batches
+embedding_broker = EmbeddingBroker(EMBEDDING_MODEL, max_batch_size=EMBEDDING_MAX_BATCH, max_wait=EMBEDDING_MAX_WAIT)
 
-def store_document(content: str, metadata: dict):
+def get_embedding(text: str or List[str], priority: int = INTERACTIVE) -> List[float] or List[List[float]]:
+    if isinstance(text, str):
+        return embedding_broker.embed([text], priority)[0]
+    elif isinstance(text, list):
+        return embedding_broker.embed(text, priority)
+    else:
+        raise ValueError("Input must be a string or a list of strings")
+
+def store_document(content: str, metadata: dict, embedding: List[float] = None) -> bool:
+    # True once the chunk is committed
     conn = connect_db()
     if not conn:
-        return
+        return False
     try:
-        embedding = get_embedding(content)
+        if embedding is None:
+            embedding = get_embedding(content, priority=BACKGROUND)
         with conn.cursor() as cur:
             cur.execute(
                 sql.SQL("INSERT INTO documents (content, metadata, embedding) VALUES (%s, %s, %s)"),
                 (content, psycopg2.extras.Json(metadata), embedding)
             )
         conn.commit()
+        return True
     except psycopg2.Error as e:
         print(f"Error storing document: {e}")
         conn.rollback()
+        return False
     finally:
-        conn.close()
+        release_db(conn)
 
 def retrieve_similar_documents(query: str, limit: int = 5) -> List[Tuple[str, float]]:
     conn = connect_db()
@@ -129,19 +202,19 @@ def retrieve_similar_documents(query: str, limit: int = 5) -> List[Tuple[str, fl
         with conn.cursor() as cur:
             cur.execute(
                 sql.SQL("""
-                    SELECT content, 1 - (embedding <=> %s) AS similarity
+                    SELECT content, 1 - (embedding <=> %(embedding)s::vector) AS similarity
                     FROM documents
-                    ORDER BY similarity DESC
-                    LIMIT %s
+                    ORDER BY embedding <=> %(embedding)s::vector
+                    LIMIT %(limit)s
                 """),
-                (query_embedding, limit)
+                {"embedding": query_embedding, "limit": limit}
             )
             return cur.fetchall()
     except psycopg2.Error as e:
         print(f"Error retrieving similar documents: {e}")
         return []
     finally:
-        conn.close()
+        release_db(conn)
 
 def process_document(file_path: str):
     print(f"Debug: Starting to process document: {file_path}")
@@ -181,11 +254,14 @@ def process_document(file_path: str):
         
         print(f"Debug: Split content into {len(chunks)} chunks")
         
+        # One broker request per document; it is split into batches alongside other sessions' texts
+        embeddings = get_embedding([chunk.page_content for chunk in chunks], priority=BACKGROUND)
+        
         successful_chunks = 0
-        for i, chunk in enumerate(chunks):
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
             try:
-                store_document(chunk.page_content, {"source": file_path, "chunk_index": i})
-                successful_chunks += 1
+                if store_document(chunk.page_content, {"source": file_path, "chunk_index": i}, embedding):
+                    successful_chunks += 1
             except Exception as e:
                 print(f"Error storing chunk {i}: {e}")
         
@@ -196,6 +272,11 @@ def process_document(file_path: str):
         print(f"Debug: Exception type: {type(e)}")
         print(f"Stack trace: {traceback.format_exc()}")
 
+def process_documents(file_paths: List[str], workers: int = INGEST_WORKERS):
+    # Embedding mostly waits on Ollama, so threads overlap one document's parsing with another's embedding
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(process_document, file_paths))
+
 def forget_document(file_path: str):
     conn = connect_db()
     if not conn:
@@ -212,7 +293,7 @@ def forget_document(file_path: str):
         print(f"Error removing document: {e}")
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
 
 def list_documents():
     conn = connect_db()
@@ -232,7 +313,7 @@ def list_documents():
         print(f"Error listing documents: {e}")
         return []
     finally:
-        conn.close()
+        release_db(conn)
 
 def create_queries(prompt):
     query_message = "Generate a list of search queries to find relevant context for the following prompt. Return only a Python list of strings."
@@ -252,12 +333,13 @@ def create_queries(prompt):
     except:
         return [prompt]
 
-def retrieve_similar_documents(query: str or List[str], limit: int = 5) -> List[Tuple[str, float]]:
+def retrieve_similar_documents(query: str or List[str], limit: int = 5, query_embedding: List[float] = None) -> List[Tuple[str, float]]:
     conn = connect_db()
     if not conn:
         return []
     try:
-        query_embedding = get_embedding(query)
+        if query_embedding is None:
+            query_embedding = get_embedding(query)
         if not query_embedding:
             return []
         
@@ -268,19 +350,19 @@ def retrieve_similar_documents(query: str or List[str], limit: int = 5) -> List[
         with conn.cursor() as cur:
             cur.execute(
                 sql.SQL("""
-                    SELECT content, 1 - (embedding <=> %s::vector) AS similarity
+                    SELECT content, 1 - (embedding <=> %(embedding)s::vector) AS similarity
                     FROM documents
-                    ORDER BY similarity DESC
-                    LIMIT %s
+                    ORDER BY embedding <=> %(embedding)s::vector
+                    LIMIT %(limit)s
                 """),
-                (query_embedding, limit)
+                {"embedding": query_embedding, "limit": limit}
             )
             return cur.fetchall()
     except psycopg2.Error as e:
         print(f"Error retrieving similar documents: {e}")
         return []
     finally:
-        conn.close()
+        release_db(conn)
 
 def classify_embedding(query: str, context: str) -> str:
     classify_message = "Determine if the given context is directly related to the query. Respond with only 'yes' or 'no'."
@@ -292,17 +374,88 @@ def classify_embedding(query: str, context: str) -> str:
     response = ollama.chat(model=CHAT_MODEL, messages=classify_convo)
     return response['message']['content'].strip().lower()
 
-def recall(prompt: str) -> List[dict]:
+def classify_embeddings(query: str, contexts: List[str]) -> List[bool]:
+    # Grade every candidate in a single chat call with structured output
+    classify_message = (
+        "For each numbered context, determine if it is directly related to the query. "
+        'Respond with only a JSON object of the form {"relevant": [numbers of the related contexts]}.'
+    )
+    numbered = "\n\n".join(f"[{i}] {context}" for i, context in enumerate(contexts))
+    classify_convo = [
+        {"role": "system", "content": classify_message},
+        {"role": "user", "content": f"Query: {query}\n\nContexts:\n{numbered}"}
+    ]
+    
+    response = ollama.chat(model=CHAT_MODEL, messages=classify_convo, format="json")
+    try:
+        relevant = {int(i) for i in json.loads(response['message']['content'])["relevant"]}
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Could not parse relevance grades, keeping all contexts: {e}")
+        return [True] * len(contexts)
+    return [i in relevant for i in range(len(contexts))]
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    # Loaded once per server process on first use; sentence-transformers is only needed for this filter
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            from sentence_transformers import CrossEncoder
+            _reranker = CrossEncoder(RERANK_MODEL)
+        return _reranker
+
+def filter_relevant(query: str, documents: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    if not documents:
+        return []
+    if RELEVANCE_FILTER == "cross_encoder":
+        try:
+            scores = get_reranker().predict([(query, content) for content, _ in documents])
+            return [doc for doc, score in zip(documents, scores) if score >= RELEVANCE_THRESHOLD]
+        except ImportError:
+            print("sentence-transformers is not installed, falling back to the LLM relevance filter.")
+    keep = classify_embeddings(query, [content for content, _ in documents])
+    return [doc for doc, relevant in zip(documents, keep) if relevant]
+
+class QuestionTrace:
+    # Stages of one question, created per call so concurrent sessions never share one. spans feed the
+    # waterfall: stage, start and duration in seconds from the start of recall, plus counts for the tooltip.
+    # timings maps each stage to its duration for the caption.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.timings = {}
+
+    def stage(self, stage: str, start: float, **detail) -> float:
+        end = time.perf_counter()
+        self.spans.append({"stage": stage, "start": start - self.start, "duration": end - start, **detail})
+        self.timings[stage] = end - start
+        return end - start
+
+def recall(prompt: str, trace: QuestionTrace = None) -> List[dict]:
+    trace = trace or QuestionTrace()
+    
+    start = time.perf_counter()
     queries = create_queries(prompt)
-    embeddings = []
-    for query in queries:
-        similar_docs = retrieve_similar_documents(query)
-        embeddings.extend(similar_docs)
+    trace.stage("queries", start, queries=len(queries))
     
-    relevant_embeddings = [
-        embedding for embedding in embeddings
-        if classify_embedding(prompt, embedding[0]) == "yes"
-    ]
+    start = time.perf_counter()
+    query_embeddings = get_embedding(queries)
+    trace.stage("embedding", start, texts=len(queries))
+    
+    start = time.perf_counter()
+    embeddings = {}
+    for query, query_embedding in zip(queries, query_embeddings):
+        for content, sim in retrieve_similar_documents(query, query_embedding=query_embedding):
+            # The same chunk can come back for several queries; grade it once at its best similarity
+            embeddings[content] = max(sim, embeddings.get(content, sim))
+    trace.stage("retrieval", start, candidates=len(embeddings))
+    
+    start = time.perf_counter()
+    relevant_embeddings = filter_relevant(prompt, list(embeddings.items()))
+    trace.stage("relevance", start, kept=len(relevant_embeddings))
+    print("Recall timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in trace.timings.items()))
     
     context = [{"role": "system", "content": f"Relevant context (similarity {sim:.2f}):\n{content}"} for content, sim in relevant_embeddings]
     print(f"Added {len(context)} relevant contexts.")
@@ -324,22 +477,34 @@ def colorize_output(text, color):
     }
     return f"{color_map[color]}{text}"
 
-def stream_response(prompt: str, context: List[dict]):
+def generate_response(prompt: str, context: List[dict], trace: QuestionTrace = None) -> Iterator[str]:
+    # Yields the answer token by token so the page can render it as it is generated;
+    # pass the question's trace to record time to first token and generation time in it
     messages = [
         {"role": "system", "content": "You are a helpful AI assistant. If provided with context, use it to answer questions accurately. If no context is provided, answer to the best of your ability based on your training."},
     ] + context + [
         {"role": "user", "content": prompt}
     ]
     
-    print(colorize_output("Assistant: ", "yellow"), end="", flush=True)
-    response = ""
+    trace = trace or QuestionTrace()
+    start = time.perf_counter()
+    tokens = 0
     for chunk in ollama.chat(model=CHAT_MODEL, messages=messages, stream=True):
-        content = chunk['message']['content']
-        response += content
+        if "first token" not in trace.timings:
+            trace.stage("first token", start)
+        tokens = chunk.get('eval_count', tokens + 1)
+        yield chunk['message']['content']
+    trace.stage("generation", start, tokens=tokens)
+
+def stream_response(prompt: str, context: List[dict]):
+    print(colorize_output("Assistant: ", "yellow"), end="", flush=True)
+    pieces = []
+    for content in generate_response(prompt, context):
+        pieces.append(content)
         print(colorize_output(content, "green"), end="", flush=True)
     
     print("\n")
-    return response
+    return "".join(pieces)
 
 def main():
     initialize_db()
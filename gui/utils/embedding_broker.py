@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List
+import ollama
+
+# Priorities: queries typed by someone waiting on an answer go ahead of document ingestion
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class EmbeddingBroker:
+    # Coalesces embedding requests from every Streamlit session and ingestion thread into
+    # one Ollama call per micro-batch. A batch is sent once it holds max_batch_size texts or
+    # the oldest queued text has waited max_wait seconds, whichever comes first.
+
+    def __init__(self, model: str, max_batch_size: int = 32, max_wait: float = 0.01, history: int = 1000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queues = (deque(), deque())
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.texts = 0
+        self.batch_sizes = deque(maxlen=history)
+        self.queue_delays = deque(maxlen=history)
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-broker", daemon=True)
+                self._thread.start()
+
+    def embed(self, texts: List[str], priority: int = INTERACTIVE) -> List[List[float]]:
+        # Blocks until every text is embedded; a text whose batch failed gets an empty embedding
+        self.start()
+        futures = []
+        with self._cond:
+            for text in texts:
+                future = Future()
+                self._queues[priority].append((text, time.perf_counter(), future))
+                futures.append(future)
+            self._cond.notify()
+        return [future.result() for future in futures]
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self.pending():
+                self._cond.wait()
+            oldest = min(queue[0][1] for queue in self._queues if queue)
+            deadline = oldest + self.max_wait
+            while self.pending() < self.max_batch_size and time.perf_counter() < deadline:
+                self._cond.wait(deadline - time.perf_counter())
+            batch = []
+            for queue in self._queues:
+                while queue and len(batch) < self.max_batch_size:
+                    batch.append(queue.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            sent = time.perf_counter()
+            try:
+                embeddings = ollama.embed(model=self.model, input=[text for text, _, _ in batch])['embeddings']
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"expected {len(batch)} embeddings, got {len(embeddings)}")
+            except Exception as e:
+                print(f"Error generating embedding: {e}")
+                embeddings = [[] for _ in batch]
+            with self._cond:
+                self.batches += 1
+                self.texts += len(batch)
+                self.batch_sizes.append(len(batch))
+                self.queue_delays.extend(sent - enqueued for _, enqueued, _ in batch)
+            for (_, _, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def stats(self) -> dict:
+        # Over the last `history` batches and texts
+        with self._cond:
+            sizes = list(self.batch_sizes)
+            delays = sorted(self.queue_delays)
+            pending = self.pending()
+
+        def percentile(p):
+            return delays[min(len(delays) - 1, int(p * len(delays)))] * 1000 if delays else 0.0
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "pending": pending,
+            "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "max_batch_size": max(sizes, default=0),
+            "p50_queue_delay_ms": percentile(0.5),
+            "p95_queue_delay_ms": percentile(0.95),
+        }